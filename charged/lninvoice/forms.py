@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.contenttypes.models import ContentType
 
 from charged.lninvoice.models import Invoice
-from charged.lnnode.models import get_all_nodes
+from charged.lnnode.models import get_all_nodes, get_node
 
 
 class InvoiceAdminForm(forms.ModelForm):
@@ -50,7 +50,7 @@ class InvoiceAdminForm(forms.ModelForm):
 
         try:
             lnnode_id = self.cleaned_data['lnnode']   # present on create
-            lnnode = dict(get_all_nodes()).get(lnnode_id)
+            lnnode = get_node(lnnode_id)
 
             self.cleaned_data['content_type'] = ContentType.objects.get_for_model(lnnode)
             self.cleaned_data['object_id'] = self.cleaned_data['lnnode']
@@ -1,6 +1,7 @@
 import base64
 import os
 import uuid
+from itertools import chain
 
 import qrcode
 from django.conf import settings
@@ -9,7 +10,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags.humanize import intword
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.timezone import now, make_aware
@@ -19,9 +20,15 @@ from djmoney.models.fields import MoneyField
 from djmoney.money import Money
 
 from charged.lninvoice.signals import lninvoice_paid, lninvoice_invoice_created_on_node
+from charged.lnnode import routing
 from charged.lnnode.models.base import BaseLnNode
 from charged.lnpurchase.models import PurchaseOrder
-from charged.utils import add_change_log_entry
+from charged.utils import add_change_log_entries, add_change_log_entry
+
+
+class LnInvoiceCreateError(Exception):
+    """The Lightning Node returned an error (or nothing) instead of a new invoice"""
+    pass
 
 
 def get_qr_image_path(_, filename):
@@ -213,6 +220,10 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # status is shared with PurchaseOrderInvoice (multi-table inheritance)
+            models.Index(fields=['status'], name='lninvoice_invoice_status_idx'),
+        ]
 
     def __str__(self):
         return str(self.label)
@@ -234,11 +245,7 @@ class Invoice(models.Model):
 
         add_change_log_entry(self, "create_invoice on node started")
 
-        create_result = self.lnnode.create_invoice(
-            memo=f'{self.label}',
-            value=int(self.amount_full_satoshi),
-            expiry=self.expiry
-        )
+        create_result = self.lnnode_create_invoice_with_failover()
 
         add_change_log_entry(self, "create_invoice on node finished")
 
@@ -261,10 +268,42 @@ class Invoice(models.Model):
 
         return True
 
-    def lnnode_sync_invoice(self):
+    def lnnode_create_invoice_with_failover(self):
+        """create the invoice on the node - if that fails on the other usable nodes of the owner (see
+        charged.lnnode.routing) and switch the invoice to the first node that succeeded"""
+        first_node = self.lnnode
+        alternatives = (node for node in routing.get_nodes(first_node.owner_id)
+                        if not (type(node) is type(first_node) and node.pk == first_node.pk))
+
+        error = None
+        for node in chain([first_node], alternatives):
+            try:
+                create_result = node.create_invoice(
+                    memo=f'{self.label}',
+                    value=int(self.amount_full_satoshi),
+                    expiry=self.expiry
+                )
+                # the backends return API errors (e.g. node not reachable) instead of raising them
+                if not create_result or create_result.get('error'):
+                    raise LnInvoiceCreateError(create_result and create_result.get('error') or 'no result')
+            except Exception as err:
+                add_change_log_entry(self, f"create_invoice on node failed: {node} ({err})")
+                error = error or err
+                continue
+
+            if node is not first_node:
+                self.lnnode = node
+                self.save(update_fields=['content_type', 'object_id'])
+                add_change_log_entry(self, f"switched to node: {node}")
+            return create_result
+
+        raise error
+
+    def lnnode_sync_invoice(self, lookup_result=None):
         payment_detected = False
         # ToDo(frennkie) error handling?
-        lookup_result = self.lnnode.get_invoice(r_hash=self.payment_hash)
+        if lookup_result is None:
+            lookup_result = self.lnnode.get_invoice(r_hash=self.payment_hash)
 
         # ToDo(frennkie) sync *complete* data here..
         if not self.preimage:
@@ -309,12 +348,16 @@ class Invoice(models.Model):
 
         if self.status == self.UNPAID:
             if lookup_result.get('settled'):
-                payment_detected = True
-
                 self.status = self.PAID
                 self.paid_at = make_aware(
                     timezone.datetime.utcfromtimestamp(int(lookup_result.get('settle_date'))))
 
+                # the invoice may have been settled by another path in the meantime (listen_invoices,
+                # reconcile_invoices or check_lni_for_successful_payment) - only the one that changes the
+                # status from UNPAID to PAID handles the payment (i.e. sends lninvoice_paid)
+                payment_detected = bool(Invoice.objects.filter(pk=self.pk, status=self.UNPAID)
+                                        .update(status=self.PAID, paid_at=self.paid_at))
+
         if self.has_expired and self.status != self.PAID:
             self.status = self.EXPIRED
 
@@ -333,6 +376,80 @@ class Invoice(models.Model):
 
         return True
 
+    @classmethod
+    def lnnode_sync_settled_invoice(cls, lnnode, result: dict):
+        """apply a settled invoice of lnnode (e.g. from stream_invoices) to the matching unpaid invoice"""
+        r_hash = result.get('r_hash')
+        if not r_hash or not result.get('settled'):
+            return None
+
+        obj = cls.objects \
+            .filter(content_type=ContentType.objects.get_for_model(lnnode), object_id=str(lnnode.pk)) \
+            .filter(payment_hash=base64.b64decode(r_hash)) \
+            .filter(status=cls.UNPAID) \
+            .first()
+
+        if obj:
+            obj.lnnode_sync_invoice(lookup_result=result)
+        return obj
+
+    @classmethod
+    def lnnode_reconcile_invoices(cls, lnnode, results: list):
+        """apply the invoices of lnnode (e.g. from list_invoices) to the matching unpaid invoices: all status
+        changes are written in bulk and lninvoice_paid is sent for the settled ones once the transaction commits
+        (call this in transaction.atomic()). Returns (paid, expired).
+
+        The invoices are locked until the transaction commits - invoices that are locked by another path
+        (e.g. settled by listen_invoices right now) are skipped and picked up by the next run."""
+        results = {base64.b64decode(x['r_hash']): x for x in results if x.get('r_hash')}
+        if not results:
+            return [], []
+
+        objs = cls.objects \
+            .filter(content_type=ContentType.objects.get_for_model(lnnode), object_id=str(lnnode.pk)) \
+            .filter(payment_hash__in=list(results)) \
+            .filter(status=cls.UNPAID) \
+            .select_for_update(skip_locked=True)
+
+        paid, expired = [], []
+        for obj in objs:
+            result = results[bytes(obj.payment_hash)]
+            if result.get('settled') or result.get('state') == 'SETTLED':
+                obj.status = cls.PAID
+                obj.paid_at = make_aware(timezone.datetime.utcfromtimestamp(int(result.get('settle_date'))))
+                _r_preimage = result.get('r_preimage')
+                if not obj.preimage and _r_preimage:
+                    obj.preimage = base64.b64decode(_r_preimage)
+                paid.append(obj)
+
+            elif result.get('state') == 'CANCELED' or (obj.expires_at and obj.has_expired):
+                obj.status = cls.EXPIRED
+                expired.append(obj)
+
+        if not paid and not expired:
+            return paid, expired
+
+        modified_at = timezone.now()
+        for obj in paid + expired:
+            obj.modified_at = modified_at
+        cls.objects.bulk_update(paid + expired, ['status', 'paid_at', 'preimage', 'modified_at'])
+        add_change_log_entries(expired, f"reconciled (current status: {cls.EXPIRED})")
+
+        if paid:
+            add_change_log_entries(paid, f"reconciled (current status: {cls.PAID}) - payment detected")
+
+            def on_commit():
+                key = 'ip2tor.metrics.payments.sats'
+                con = get_redis_connection("default")
+                con.rpush(key, *[obj.amount_full_satoshi for obj in paid])
+
+                for obj in paid:
+                    lninvoice_paid.send(sender=cls, instance=obj)
+
+            transaction.on_commit(on_commit)
+
+        return paid, expired
+
     @property
     def has_expired(self):
         return timezone.now() > self.expires_at
@@ -423,9 +540,9 @@ class PurchaseOrderInvoice(Invoice):
         verbose_name_plural = _("Purchase Order Invoices")
 
     # ToDo(frennkie): this could also be called by signal
-    def lnnode_sync_invoice(self):
+    def lnnode_sync_invoice(self, lookup_result=None):
         previous_status = self.status
-        super().lnnode_sync_invoice()
+        super().lnnode_sync_invoice(lookup_result=lookup_result)
 
         if previous_status == self.status:
             return
@@ -442,3 +559,22 @@ class PurchaseOrderInvoice(Invoice):
             self.po.status = PurchaseOrder.NEEDS_TO_BE_PAID
             self.po.save()
             add_change_log_entry(self.po, "set to NEEDS_TO_BE_PAID")
+
+    @classmethod
+    def lnnode_reconcile_invoices(cls, lnnode, results: list):
+        paid, expired = super().lnnode_reconcile_invoices(lnnode, results)
+
+        # same as lnnode_sync_invoice (but in bulk) for the purchase orders of the changed invoices
+        for invoices, status, message in ((paid, PurchaseOrder.PAID, "set to PAID"),
+                                          (expired, PurchaseOrder.NEEDS_TO_BE_PAID, "set to NEEDS_TO_BE_PAID")):
+            if not invoices:
+                continue
+            pos = list(PurchaseOrder.objects
+                       .filter(ln_invoices__in=invoices)
+                       .exclude(status__in=(PurchaseOrder.PAID, status)))
+            if pos:
+                PurchaseOrder.objects.filter(pk__in=[po.pk for po in pos]).update(status=status,
+                                                                                 modified_at=timezone.now())
+                add_change_log_entries(pos, message)
+
+        return paid, expired
@@ -1,7 +1,11 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.db import transaction
+from django.utils import timezone
 
 from charged.lninvoice.models import PurchaseOrderInvoice
+from charged.lnnode.models import get_all_nodes
+from charged.utils import buffered_change_log
 
 logger = get_task_logger(__name__)
 
@@ -22,7 +26,12 @@ class LnInvoiceHasExpiredError(Exception):
     pass
 
 
+class LnInvoiceListError(Exception):
+    pass
+
+
 @shared_task(bind=True)
+@buffered_change_log()
 def process_initial_lni(self, obj_id):
     logger.info('Running on ID: %s' % obj_id)
 
@@ -53,6 +62,7 @@ def process_initial_lni(self, obj_id):
              retry_backoff=False,
              retry_backoff_max=60,
              retry_jitter=True)
+@buffered_change_log()
 def check_lni_for_successful_payment(self, obj_id):
     logger.info('Running on ID: %s' % obj_id)
 
@@ -81,3 +91,64 @@ def check_lni_for_successful_payment(self, obj_id):
     else:
         # raise exception that will be (auto-)retried
         raise LnInvoiceNoPaymentError()
+
+
+def list_node_invoices(node, max_invoices):
+    """the invoices that were added on the node after its cursor (add_index) page by page - usually one
+    ListInvoices call"""
+    index_offset = node.add_index
+    while True:
+        result = node.list_invoices(index_offset=index_offset, num_max_invoices=max_invoices)
+        if not result or result.get('error'):
+            raise LnInvoiceListError(result and result.get('error'))
+
+        page = result.get('invoices', [])
+        if page:
+            yield page
+        if len(page) < max_invoices:
+            return
+        index_offset = int(result.get('last_index_offset'))
+
+
+def get_reconciled_add_index(add_index, invoices):
+    """the add index up to which no invoice can change any more (i.e. the one before the first open invoice)
+    and whether that includes all invoices"""
+    now = timezone.now().timestamp()
+    for item in sorted(invoices, key=lambda x: int(x.get('add_index', 0))):
+        if item.get('state') in ('OPEN', 'ACCEPTED') and \
+                int(item.get('creation_date', 0)) + int(item.get('expiry', 0)) > now:
+            return add_index, False
+        add_index = max(add_index, int(item.get('add_index', 0)))
+    return add_index, True
+
+
+def reconcile_node_invoices(node, max_invoices):
+    """reconcile the invoices of the node - each page of invoices (and the cursor) in one transaction"""
+    add_index, complete = node.add_index, True
+    for page in list_node_invoices(node, max_invoices):
+        with transaction.atomic():
+            paid, expired = PurchaseOrderInvoice.lnnode_reconcile_invoices(node, page)
+            logger.info('Node: %s - %s invoices listed, %s paid, %s expired' % (node, len(page), len(paid),
+                                                                                 len(expired)))
+
+            if complete:
+                add_index, complete = get_reconciled_add_index(add_index, page)
+                if add_index > node.add_index:
+                    # don't use save() - that would run a full alive check
+                    type(node).objects.filter(pk=node.pk).update(add_index=add_index)
+                    node.add_index = add_index
+
+
+@shared_task(bind=True, ignore_result=True)
+@buffered_change_log()
+def reconcile_invoices(self, max_invoices=1000):
+    """periodic: apply the settled and expired invoices of each node that supports listing (one ListInvoices
+    call per node for the invoices added since its cursor) instead of looking up each invoice on its own"""
+    for _, node in get_all_nodes():
+        if not node.is_enabled or not node.supports_listing:
+            continue
+
+        try:
+            reconcile_node_invoices(node, max_invoices)
+        except Exception as err:
+            logger.warning('Unable to reconcile invoices of Node: %s - skipping (%s)' % (node, err))
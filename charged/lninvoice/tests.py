@@ -0,0 +1,187 @@
+import base64
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.utils import timezone
+
+from charged.lninvoice.models import PurchaseOrderInvoice
+from charged.lninvoice.signals import lninvoice_paid
+from charged.lninvoice.tasks import reconcile_invoices
+from charged.lnnode.management.commands import listen_invoices
+from charged.lnnode.models import FakeNode, LndGRpcNode, LndRestNode
+from charged.lnpurchase.models import PurchaseOrder
+from shop.models import Host, ShopPurchaseOrder, TorBridge
+
+
+def create_owner():
+    owner = get_user_model().objects.create(username='owner', is_staff=True)
+    # change log entries are written for user_id=1
+    get_user_model().objects.get_or_create(pk=1, defaults={'username': 'admin'})
+    return owner
+
+
+class InvoiceFailoverTest(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.first = FakeNode.objects.create(owner=self.owner, name='first', priority=0)
+        self.second = FakeNode.objects.create(owner=self.owner, name='second', priority=0)
+        self.backup = FakeNode.objects.create(owner=self.owner, name='backup', priority=1)
+        FakeNode.objects.create(owner=self.owner, name='disabled', priority=0, is_enabled=False)
+
+    @mock.patch('shop.signals.process_initial_lni')
+    def test_invoice_fails_over_to_next_node(self, process_initial_lni):
+        lni = PurchaseOrderInvoice.objects.create(lnnode=self.first, msatoshi=1000)
+
+        with mock.patch.object(FakeNode, 'create_invoice', autospec=True,
+                               side_effect=lambda node, **kwargs: {'r_hash': 'AQ=='} if node.name == 'backup' else 1 / 0):
+            lni.lnnode_create_invoice_with_failover()
+
+        lni.refresh_from_db()
+        self.assertEqual(lni.lnnode, self.backup)
+
+    @mock.patch('shop.signals.process_initial_lni')
+    def test_invoice_fails_over_on_error_result(self, process_initial_lni):
+        lni = PurchaseOrderInvoice.objects.create(lnnode=self.first, msatoshi=1000)
+
+        with mock.patch.object(FakeNode, 'create_invoice', autospec=True,
+                               side_effect=lambda node, **kwargs: {'r_hash': 'AQ=='} if node.name == 'second'
+                               else {'error': 'unreachable'}):
+            self.assertEqual(lni.lnnode_create_invoice_with_failover(), {'r_hash': 'AQ=='})
+
+        lni.refresh_from_db()
+        self.assertEqual(lni.lnnode, self.second)
+
+
+@mock.patch('charged.lninvoice.models.get_redis_connection')
+class SettledInvoiceTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        with mock.patch.object(LndGRpcNode, 'check_alive_status', return_value=(True, None)):
+            self.node = LndGRpcNode.objects.create(owner=owner, hostname='node.example')
+        self.other_node = FakeNode.objects.create(owner=owner)
+        host = Host.objects.create(ip='192.0.2.1', owner=owner)
+
+        with mock.patch('shop.signals.process_initial_purchase_order'), \
+                mock.patch('shop.signals.process_initial_lni'):
+            self.po = ShopPurchaseOrder.tor_bridges.create(host=host, target='example.onion:80')
+            self.lni = PurchaseOrderInvoice.objects.create(
+                po=self.po, lnnode=self.node, payment_hash=b'\x01' * 32, msatoshi=25000,
+                status=PurchaseOrderInvoice.UNPAID, qr_image='invoices/qr.png', creation_at=timezone.now(),
+                expires_at=timezone.now() + timedelta(minutes=15))
+
+        self.settled = {'r_hash': base64.b64encode(b'\x01' * 32).decode(), 'settled': True, 'settle_index': '7',
+                        'settle_date': str(int(timezone.now().timestamp())), 'expiry': '900'}
+
+    def test_only_matching_unpaid_invoice_of_node_is_synced(self, get_redis_connection):
+        self.assertIsNone(PurchaseOrderInvoice.lnnode_sync_settled_invoice(self.node, {**self.settled,
+                                                                                     'settled': False}))
+        self.assertIsNone(PurchaseOrderInvoice.lnnode_sync_settled_invoice(self.other_node, self.settled))
+        self.assertEqual(PurchaseOrderInvoice.objects.get(pk=self.lni.pk).status, PurchaseOrderInvoice.UNPAID)
+
+    def test_stream_item_settles_invoice_and_purchase_order(self, get_redis_connection):
+        listen_invoices.Command().process(self.node, self.settled)
+
+        self.assertEqual(PurchaseOrderInvoice.objects.get(pk=self.lni.pk).status, PurchaseOrderInvoice.PAID)
+        self.assertEqual(PurchaseOrder.objects.get(pk=self.po.pk).status, PurchaseOrder.PAID)
+        self.assertEqual(TorBridge.objects.get().status, TorBridge.NEEDS_ACTIVATE)
+        self.assertEqual(LndGRpcNode.objects.get(pk=self.node.pk).settle_index, 7)
+
+    def test_invoice_settled_by_another_path_is_not_paid_twice(self, get_redis_connection):
+        stale = PurchaseOrderInvoice.objects.get(pk=self.lni.pk)  # e.g. check_lni_for_successful_payment
+        receiver = mock.Mock()
+        lninvoice_paid.connect(receiver)
+        self.addCleanup(lninvoice_paid.disconnect, receiver)
+
+        PurchaseOrderInvoice.lnnode_sync_settled_invoice(self.node, self.settled)
+        stale.lnnode_sync_invoice(lookup_result=self.settled)
+
+        receiver.assert_called_once()
+        self.assertEqual(stale.status, PurchaseOrderInvoice.PAID)
+        get_redis_connection.return_value.rpush.assert_called_once()
+
+
+@mock.patch('charged.lninvoice.models.get_redis_connection')
+class ReconcileInvoicesTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        with mock.patch.object(LndRestNode, 'check_alive_status', return_value=(True, None)):
+            self.node = LndRestNode.objects.create(owner=owner, macaroon_invoice='abcd')
+        host = Host.objects.create(ip='192.0.2.1', owner=owner)
+
+        expires_at = timezone.now() + timedelta(minutes=15)
+        self.pos, self.invoices = [], []
+        with mock.patch('shop.signals.process_initial_purchase_order'), \
+                mock.patch('shop.signals.process_initial_lni'):
+            for i in range(3):
+                po = ShopPurchaseOrder.tor_bridges.create(host=host, target=f'example{i}.onion:80')
+                self.pos.append(po)
+                self.invoices.append(PurchaseOrderInvoice.objects.create(
+                    po=po, lnnode=self.node, payment_hash=bytes([i]) * 32, msatoshi=25000,
+                    status=PurchaseOrderInvoice.UNPAID, expires_at=expires_at))
+
+        now = int(timezone.now().timestamp())
+        listed = [('SETTLED', bytes([0]) * 32), ('CANCELED', bytes([1]) * 32), ('OPEN', bytes([2]) * 32),
+                  ('SETTLED', b'\xff' * 32)]  # the last one is not ours
+        self.listed = [{'r_hash': base64.b64encode(r_hash).decode(), 'state': state, 'settled': state == 'SETTLED',
+                        'add_index': str(i + 1), 'settle_date': str(now), 'creation_date': str(now), 'expiry': '900'}
+                       for i, (state, r_hash) in enumerate(listed)]
+
+    def test_status_changes_are_applied_and_cursor_advanced(self, get_redis_connection):
+        with mock.patch.object(LndRestNode, 'list_invoices', autospec=True,
+                               return_value={'invoices': self.listed, 'last_index_offset': '4'}) as list_invoices, \
+                self.captureOnCommitCallbacks(execute=True):
+            reconcile_invoices()
+
+        list_invoices.assert_called_once_with(self.node, index_offset=0, num_max_invoices=1000)
+        self.assertEqual([PurchaseOrderInvoice.objects.get(pk=x.pk).status for x in self.invoices],
+                         [PurchaseOrderInvoice.PAID, PurchaseOrderInvoice.EXPIRED, PurchaseOrderInvoice.UNPAID])
+        self.assertEqual([PurchaseOrder.objects.get(pk=x.pk).status for x in self.pos],
+                         [PurchaseOrder.PAID, PurchaseOrder.NEEDS_TO_BE_PAID, PurchaseOrder.INITIAL])
+        # lninvoice_paid was sent for the settled invoice only
+        self.assertEqual([x.status for x in TorBridge.objects.order_by('target')],
+                         [TorBridge.NEEDS_ACTIVATE, TorBridge.INITIAL, TorBridge.INITIAL])
+        get_redis_connection.return_value.rpush.assert_called_once_with('ip2tor.metrics.payments.sats', '25')
+
+        # the cursor stops before the open invoice
+        self.assertEqual(LndRestNode.objects.get(pk=self.node.pk).add_index, 2)
+        with mock.patch.object(LndRestNode, 'list_invoices', autospec=True,
+                               return_value={'invoices': self.listed[2:]}) as list_invoices:
+            reconcile_invoices()
+        list_invoices.assert_called_once_with(mock.ANY, index_offset=2, num_max_invoices=1000)
+
+    def test_invoices_locked_by_another_path_are_skipped(self, get_redis_connection):
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as select_for_update, \
+                transaction.atomic():
+            PurchaseOrderInvoice.lnnode_reconcile_invoices(self.node, self.listed)
+
+        select_for_update.assert_called_once_with(mock.ANY, skip_locked=True)
+        self.assertEqual(select_for_update.call_args[0][0].model, PurchaseOrderInvoice)
+
+        pages = [{'invoices': self.listed[:2], 'last_index_offset': '2'}, {'invoices': self.listed[2:3]}]
+        with mock.patch.object(LndRestNode, 'list_invoices', autospec=True, side_effect=pages) as list_invoices:
+            reconcile_invoices(max_invoices=2)
+
+        self.assertEqual([x.kwargs['index_offset'] for x in list_invoices.call_args_list], [0, 2])
+        self.assertEqual(PurchaseOrderInvoice.objects.filter(status=PurchaseOrderInvoice.UNPAID).count(), 1)
+
+    def test_failed_reconciliation_is_rolled_back(self, get_redis_connection):
+        def add_change_log_entries(objs, message, **kwargs):
+            if message == 'set to PAID':
+                raise RuntimeError
+
+        with mock.patch.object(LndRestNode, 'list_invoices', autospec=True,
+                               return_value={'invoices': self.listed}), \
+                mock.patch('charged.lninvoice.models.add_change_log_entries', side_effect=add_change_log_entries), \
+                self.captureOnCommitCallbacks(execute=True):
+            reconcile_invoices()
+
+        # retried by the next run - nothing was written and lninvoice_paid was not sent
+        self.assertEqual(PurchaseOrderInvoice.objects.filter(status=PurchaseOrderInvoice.UNPAID).count(), 3)
+        self.assertEqual(LndRestNode.objects.get(pk=self.node.pk).add_index, 0)
+        self.assertFalse(TorBridge.objects.exclude(status=TorBridge.INITIAL).exists())
+        get_redis_connection.assert_not_called()
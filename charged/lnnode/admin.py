@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib import admin, messages
 from django.utils.translation import gettext_lazy as _
 
+from charged.lnnode import routing
 from charged.lnnode.forms import LndRestNodeForm, LndGRpcNodeForm, CLightningNodeForm, FakeNodeForm
 from charged.lnnode.models import LndGRpcNode, CLightningNode, LndRestNode, FakeNode
 
@@ -32,7 +33,8 @@ class LndNodeAdmin(admin.ModelAdmin):
         }
 
     search_fields = ('id', 'name', 'hostname')
-    list_display = ('id', 'name', 'type', 'owner', 'hostname', 'port', 'priority', 'is_enabled', 'is_alive')
+    list_display = ('id', 'name', 'type', 'owner', 'hostname', 'port', 'priority', 'weight', 'is_enabled', 'is_alive',
+                    'probe_latency')
     list_filter = ('is_enabled', 'is_alive', 'created_at', 'owner')
 
     readonly_fields = ('type', 'is_alive')
@@ -80,7 +82,7 @@ class LndNodeAdmin(admin.ModelAdmin):
     actions = ["set_disabled", "set_enabled", "check_alive"]
 
     def set_disabled(self, request, queryset):
-        rows_updated = queryset.update(is_enabled=False)
+        rows_updated = routing.update_nodes(queryset, is_enabled=False)
         if rows_updated == 1:
             message_bit = "1 node was"
         else:
@@ -90,7 +92,7 @@ class LndNodeAdmin(admin.ModelAdmin):
     set_disabled.short_description = _("Disable selected")
 
     def set_enabled(self, request, queryset):
-        rows_updated = queryset.update(is_enabled=True)
+        rows_updated = routing.update_nodes(queryset, is_enabled=True)
         if rows_updated == 1:
             message_bit = "1 node was"
         else:
@@ -1,5 +1,6 @@
 from django.apps import AppConfig
 from django.core.cache import cache
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -18,3 +19,16 @@ class LnNodeConfig(AppConfig):
             print(f'Error [{self.verbose_name}]: '
                   'Cache backend not reachable (check settings/service).')
             raise err
+
+        from charged.lnnode import models, routing
+        from charged.lnnode.models import registry
+
+        # keep the node registry and the cached routing tables (built from the registry) up to date
+        for model in (models.CLightningNode, models.FakeNode, models.LndGRpcNode, models.LndRestNode):
+            post_save.connect(registry.sync_registry_node, sender=model)
+            post_delete.connect(registry.delete_registry_node, sender=model)
+            post_save.connect(routing.invalidate_node, sender=model)
+            post_delete.connect(routing.invalidate_node, sender=model)
+
+        # add the existing nodes to the registry
+        post_migrate.connect(models.sync_node_registry, sender=self)
@@ -0,0 +1,135 @@
+import asyncio
+import atexit
+import hashlib
+import os
+import threading
+import weakref
+
+import grpc
+import grpc.aio
+
+# Due to updated ECDSA generated tls.cert we need to let gprc know that
+# we need to use that cipher suite otherwise there will be a handshake
+# error when we communicate with the lnd rpc server.
+# (must be set before the first channel is created)
+os.environ["GRPC_SSL_CIPHER_SUITES"] = 'HIGH+ECDSA'
+
+# keep idle connections warm and detect dead ones (LND permits pings every 5s or more)
+CHANNEL_OPTIONS = (
+    ('grpc.keepalive_time_ms', 30_000),
+    ('grpc.keepalive_timeout_ms', 10_000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_receive_message_length', 50 * 1024 * 1024),
+)
+
+
+class ChannelPool:
+    """Process-wide pool of gRPC channels (one per node and credentials).
+
+    Channels connect lazily on the first call and gRPC takes care of reconnecting (with backoff)
+    if the connection is lost. A channel is only closed on shutdown() (e.g. at exit).
+    """
+
+    def __init__(self, options=CHANNEL_OPTIONS):
+        self.options = options
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._channels)
+
+    @staticmethod
+    def get_key(host: str, port: str, tls_cert: bytes, macaroon_hex: bytes):
+        return (host, str(port),
+                hashlib.sha256(tls_cert).hexdigest(),
+                hashlib.sha256(macaroon_hex).hexdigest())
+
+    def get(self, host: str, port: str, tls_cert: bytes, macaroon_hex: bytes) -> grpc.Channel:
+        key = self.get_key(host, port, tls_cert, macaroon_hex)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = self._create_channel(host, port, tls_cert, macaroon_hex)
+            return channel
+
+    def _create_channel(self, host, port, tls_cert, macaroon_hex):
+        return grpc.secure_channel('{}:{}'.format(host, port), self.get_credentials(tls_cert, macaroon_hex),
+                                   options=self.options)
+
+    @staticmethod
+    def get_credentials(tls_cert, macaroon_hex):
+        def metadata_callback(context, callback):
+            # for more info see grpc docs
+            callback([('macaroon', macaroon_hex)], None)
+
+        # build ssl credentials using the cert the same as before
+        cert_creds = grpc.ssl_channel_credentials(tls_cert)
+
+        # now build meta data credentials
+        auth_creds = grpc.metadata_call_credentials(metadata_callback)
+
+        # combine the cert credentials and the macaroon auth credentials
+        # such that every call is properly encrypted and authenticated
+        combined_creds = grpc.composite_channel_credentials(cert_creds, auth_creds)
+
+        return combined_creds
+
+    def shutdown(self):
+        """close all channels (new ones are created on demand afterwards)"""
+        with self._lock:
+            channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.close()
+
+    def _reset_after_fork(self):
+        # channels of the parent process must not be used (or closed) in a forked child (e.g. celery prefork)
+        self._channels = {}
+        self._lock = threading.Lock()
+
+
+class AioChannelPool(ChannelPool):
+    """Pool of grpc.aio channels - asyncio channels can only be used on the event loop that created them
+    so there is a separate set of channels per event loop."""
+
+    def __init__(self, options=CHANNEL_OPTIONS):
+        super().__init__(options=options)
+        self._channels = weakref.WeakKeyDictionary()  # event loop -> {key: channel}
+
+    def __len__(self):
+        return sum(len(x) for x in self._channels.values())
+
+    def get(self, host: str, port: str, tls_cert: bytes, macaroon_hex: bytes) -> grpc.aio.Channel:
+        loop = asyncio.get_running_loop()
+        key = self.get_key(host, port, tls_cert, macaroon_hex)
+        with self._lock:
+            channels = self._channels.setdefault(loop, {})
+            channel = channels.get(key)
+            if channel is None:
+                channel = channels[key] = self._create_channel(host, port, tls_cert, macaroon_hex)
+            return channel
+
+    def _create_channel(self, host, port, tls_cert, macaroon_hex):
+        return grpc.aio.secure_channel('{}:{}'.format(host, port), self.get_credentials(tls_cert, macaroon_hex),
+                                       options=self.options)
+
+    async def shutdown(self):
+        """close all channels of the running event loop"""
+        with self._lock:
+            channels = self._channels.pop(asyncio.get_running_loop(), {})
+        for channel in channels.values():
+            await channel.close()
+
+    def _reset_after_fork(self):
+        self._channels = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+
+pool = ChannelPool()
+
+aio_pool = AioChannelPool()
+
+atexit.register(pool.shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pool._reset_after_fork)
+    os.register_at_fork(after_in_child=aio_pool._reset_after_fork)
@@ -0,0 +1,94 @@
+import atexit
+import hashlib
+import os
+import ssl
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+# connections that are kept alive per node (additional connections are closed after use)
+POOL_MAXSIZE = 10
+
+
+class CaDataVerifyingHTTPAdapter(HTTPAdapter):
+    """
+    A TransportAdapter ...
+    """
+
+    def __init__(self, tls_cert, *args, **kwargs):
+        self.cadata = tls_cert
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        context = ssl.create_default_context()
+        context.load_verify_locations(cadata=self.cadata)
+        if hasattr(ssl, 'HAS_NEVER_CHECK_COMMON_NAME'):  # introduced in Python3.7
+            context.hostname_checks_common_name = False
+        context.check_hostname = False
+        kwargs['ssl_context'] = context
+        return super().init_poolmanager(*args, **kwargs)
+
+
+class SessionPool:
+    """Process-wide pool of requests sessions (one per node configuration).
+
+    Each session keeps up to POOL_MAXSIZE connections to its node alive so that the TLS handshake
+    (and loading the certificate into an SSLContext) is not done on every request.
+    """
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def get_key(base_url: str, tls_cert: str, tls_cert_verification: bool):
+        return (base_url,
+                hashlib.sha256((tls_cert or '').encode()).hexdigest(),
+                bool(tls_cert_verification))
+
+    def get(self, base_url: str, tls_cert: str, tls_cert_verification: bool) -> requests.Session:
+        key = self.get_key(base_url, tls_cert, tls_cert_verification)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._create_session(base_url, tls_cert, tls_cert_verification)
+            return session
+
+    def _create_session(self, base_url, tls_cert, tls_cert_verification):
+        session = requests.Session()
+
+        if tls_cert_verification:
+            adapter = CaDataVerifyingHTTPAdapter(tls_cert=tls_cert, pool_connections=1,
+                                                 pool_maxsize=self.pool_maxsize)
+        else:
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+            session.verify = False
+
+        session.mount(base_url, adapter)
+        return session
+
+    def shutdown(self):
+        """close all sessions (new ones are created on demand afterwards)"""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def _reset_after_fork(self):
+        # connections of the parent process must not be shared with a forked child (e.g. celery prefork)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+
+pool = SessionPool()
+
+atexit.register(pool.shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pool._reset_after_fork)
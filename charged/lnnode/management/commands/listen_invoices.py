@@ -0,0 +1,77 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from charged.lninvoice.models import PurchaseOrderInvoice
+from charged.lnnode.models import LndGRpcNode
+
+
+class Command(BaseCommand):
+    help = 'Listen for settled invoices on the streaming Lightning Nodes (LND gRPC) and ' \
+           'mark the matching invoices as paid. Resumes from the last settle index after reconnects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-backoff', type=int, default=60,
+                            help='Maximum seconds to wait between reconnects (default: 60)')
+
+    def handle(self, *args, **options):
+        self.max_backoff = options['max_backoff']
+
+        lst = LndGRpcNode.objects.filter(is_enabled=True)
+        if not lst:
+            self.stdout.write(self.style.SUCCESS('Nothing to process.'))
+            return
+
+        # one listener per node (the streams are blocking)
+        threads = [threading.Thread(target=self.listen, args=(node.pk,), name=f'listen-{node.pk}', daemon=True)
+                   for node in lst]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def listen(self, node_id):
+        backoff = 1
+        while True:
+            try:
+                # fresh instance on every (re-)connect: current settle index and is_enabled
+                node = LndGRpcNode.objects.get(pk=node_id)
+                if not node.is_enabled:
+                    self.stdout.write(f'{node}: disabled - stopping')
+                    return
+
+                self.stdout.write(f'{node}: subscribing to invoices (settle index: {node.settle_index})')
+                for item in node.stream_invoices(settle_index=node.settle_index):
+                    backoff = 1
+                    self.process(node, item)
+
+                self.stderr.write(f'{node}: invoice stream ended')
+
+            except LndGRpcNode.DoesNotExist:
+                self.stderr.write(f'Node {node_id}: not found - stopping')
+                return
+
+            except Exception as err:
+                self.stderr.write(f'Node {node_id}: {err}')
+
+            finally:
+                connection.close()
+
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def process(self, node, item):
+        if not item.get('settled'):
+            return  # e.g. newly added invoices
+
+        obj = PurchaseOrderInvoice.lnnode_sync_settled_invoice(node, item)
+        if obj:
+            self.stdout.write(self.style.SUCCESS(f'{node}: {obj} has been paid (status: {obj.status})'))
+
+        settle_index = int(item.get('settle_index', 0))
+        if settle_index > node.settle_index:
+            # don't use save() - that would run a full alive check on every invoice
+            LndGRpcNode.objects.filter(pk=node.pk).update(settle_index=settle_index)
+            node.settle_index = settle_index
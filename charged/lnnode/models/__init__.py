@@ -1,32 +1,44 @@
-from itertools import chain
+from django.contrib.contenttypes.models import ContentType
 
 from charged.lnnode.models.clightning import CLightningNode
 from charged.lnnode.models.fake import FakeNode
 from charged.lnnode.models.lnd import LndGRpcNode, LndRestNode
+from charged.lnnode.models.registry import NodeRegistryEntry
 
 __all__ = [
     'CLightningNode',
     'FakeNode',
     'LndGRpcNode',
     'LndRestNode',
-    'get_all_nodes'
+    'NodeRegistryEntry',
+    'get_all_nodes',
+    'get_node',
 ]
 
 
 def get_all_nodes(owner_id=None):
+    """[(node id, node), ...] sorted by priority (one registry query plus one query per node type)"""
+    entries = NodeRegistryEntry.objects.all()
     if owner_id:
-        fake = FakeNode.objects.filter(owner_id=owner_id)
-        lnd_grpc = LndGRpcNode.objects.filter(owner_id=owner_id)
-        lnd_rest = LndRestNode.objects.filter(owner_id=owner_id)
-        clightning = CLightningNode.objects.filter(owner_id=owner_id)
-    else:
-        fake = FakeNode.objects.all()
-        lnd_grpc = LndGRpcNode.objects.all()
-        lnd_rest = LndRestNode.objects.all()
-        clightning = CLightningNode.objects.all()
-
-    node_list = sorted(
-        chain(fake, lnd_grpc, lnd_rest, clightning),
-        key=lambda node: node.priority, reverse=False)
-
-    return [(str(x.id), x) for x in node_list]
+        entries = entries.filter(owner_id=owner_id)
+
+    return [(str(x.id), x) for x in NodeRegistryEntry.load_nodes(list(entries))]
+
+
+def get_node(node_id):
+    """the node with this id (of any type) or None"""
+    entry = NodeRegistryEntry.objects.filter(id=node_id).first()
+    if not entry:
+        return None
+    model = ContentType.objects.get_for_id(entry.content_type_id).model_class()
+    return model._default_manager.filter(pk=node_id).first()
+
+
+def sync_node_registry(sender, **kwargs):
+    """(re-)create the registry entries of all nodes and remove stale ones"""
+    node_ids = set()
+    for model in (CLightningNode, FakeNode, LndGRpcNode, LndRestNode):
+        for node in model.objects.all():
+            NodeRegistryEntry.sync_node(node)
+            node_ids.add(node.pk)
+    NodeRegistryEntry.objects.exclude(id__in=node_ids).delete()
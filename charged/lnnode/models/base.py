@@ -1,7 +1,9 @@
 import uuid
 from abc import ABCMeta, abstractmethod
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -12,6 +14,7 @@ class BaseLnNode(models.Model):
 
     type = None
     streaming = False
+    listing = False
     tor = False
 
     GET_INFO_FIELDS = {}
@@ -40,6 +43,13 @@ class BaseLnNode(models.Model):
         help_text=_('The lower the better: 0 is the highest and 32767 the lowest priority.'),
     )
 
+    weight = models.PositiveSmallIntegerField(
+        verbose_name=_('Weight'),
+        default=1,
+        help_text=_('Share of the invoices among the nodes with the same priority (weighted routing only - '
+                    '0: only if all others fail).'),
+    )
+
     name = models.CharField(
         max_length=128,
         verbose_name=_('Name'),
@@ -96,10 +106,59 @@ class BaseLnNode(models.Model):
     def stream_invoices(self, **kwargs):
         raise NotImplementedError
 
+    def list_invoices(self, **kwargs):
+        # optional (see supports_listing) - kwargs: index_offset (add index) and num_max_invoices
+        raise NotImplementedError
+
+    # async counterparts of the API above - by default the sync methods are run in a worker thread
+    # (backends that have a native asyncio client override these)
+
+    async def acheck_alive_status(self) -> (bool, str):
+        return await sync_to_async(self.check_alive_status, thread_sensitive=False)()
+
+    async def aget_info(self):
+        def _get_info():
+            info = self.get_info  # may be a (cached) property or a method
+            return info() if callable(info) else info
+
+        return await sync_to_async(_get_info, thread_sensitive=False)()
+
+    async def acreate_invoice(self, **kwargs):
+        return await sync_to_async(self.create_invoice, thread_sensitive=False)(**kwargs)
+
+    async def aget_invoice(self, **kwargs):
+        return await sync_to_async(self.get_invoice, thread_sensitive=False)(**kwargs)
+
+    async def astream_invoices(self, **kwargs):
+        stream = await sync_to_async(self.stream_invoices, thread_sensitive=False)(**kwargs)
+        _next = sync_to_async(next, thread_sensitive=False)
+        while True:
+            item = await _next(stream, StopAsyncIteration)
+            if item is StopAsyncIteration:
+                return
+            yield item
+
+    @property
+    def probe_latency_key(self):
+        return f'{self.__class__.__qualname__}.{self.id}.probe_latency'
+
+    @property
+    def probe_latency(self):
+        """duration (in seconds) of the last alive check (see node_alive_check) or None"""
+        return cache.get(self.probe_latency_key)
+
+    @probe_latency.setter
+    def probe_latency(self, value):
+        cache.set(self.probe_latency_key, value, timeout=None)
+
     @property
     def supports_streaming(self):
         return self.streaming
 
+    @property
+    def supports_listing(self):
+        return self.listing
+
     @property
     def supports_tor(self):
         return self.tor
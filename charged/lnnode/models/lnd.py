@@ -1,9 +1,10 @@
-import os
+import base64
 import ssl
 
 import grpc
 import lnrpc
 import requests
+from asgiref.sync import sync_to_async
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from django.core.cache import cache
@@ -13,9 +14,8 @@ from django.utils.datetime_safe import datetime
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from google.protobuf.json_format import MessageToDict
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
+from charged.lnnode import grpc_pool, http_pool
 from charged.lnnode.models.base import BaseLnNode
 from charged.lnnode.signals import lnnode_invoice_created
 
@@ -23,6 +23,8 @@ from charged.lnnode.signals import lnnode_invoice_created
 class LndNode(BaseLnNode):
     """Abstract model that defines shared files for both LND gRPC and LND REST"""
 
+    listing = True
+
     GET_INFO_FIELDS = {
         'identity_pubkey': 'identity_pubkey',
         'alias': 'alias',
@@ -82,6 +84,13 @@ class LndNode(BaseLnNode):
         null=True, blank=True  # optional
     )
 
+    add_index = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Add Index'),
+        help_text=_('Add index up to which all invoices of the node have been reconciled (see reconcile_invoices).')
+    )
+
     class Meta:
         abstract = True
 
@@ -201,6 +210,9 @@ class LndNode(BaseLnNode):
     def stream_invoices(self, **kwargs):
         raise NotImplementedError
 
+    def list_invoices(self, **kwargs):
+        raise NotImplementedError
+
 
 class LndGRpcNode(LndNode):
     """Implements a Lightning Node for LND gRPC"""
@@ -215,6 +227,13 @@ class LndGRpcNode(LndNode):
         validators=[MinValueValidator(1), MaxValueValidator(65535)]
     )
 
+    settle_index = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Settle Index'),
+        help_text=_('Settle index of the last settled invoice that was processed from the invoice stream.')
+    )
+
     class Meta:
         ordering = ('-priority', )
         verbose_name = _("LND gRPC Node")
@@ -299,8 +318,9 @@ class LndGRpcNode(LndNode):
                             "{}".format(err))
 
     def stream_invoices(self, **kwargs) -> dict:
+        # kwargs: add_index and/or settle_index to also receive the invoices that changed since then
         try:
-            request = lnrpc.rpc_pb2.InvoiceSubscription()
+            request = lnrpc.rpc_pb2.InvoiceSubscription(**kwargs)
 
             for response in self.stub_invoice.SubscribeInvoices(request):
                 yield MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
@@ -312,44 +332,110 @@ class LndGRpcNode(LndNode):
             raise Exception("General Error: \n"
                             "{}".format(err))
 
+    def list_invoices(self, **kwargs) -> dict:
+        # kwargs: index_offset (add index) and num_max_invoices - the invoices added after index_offset
+        try:
+            request = lnrpc.rpc_pb2.ListInvoiceRequest(**kwargs)
+            response = self.stub_invoice.ListInvoices(request)
+            return MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
+        except grpc.RpcError as err:
+            return {'error': 'Unable to process ListInvoices with Exception:\n'
+                             'gRPC API Error: \n'
+                             '{}'.format(err)}
+        except Exception as err:
+            raise Exception("General Error: \n"
+                            "{}".format(err))
+
+    # asyncio (grpc.aio) versions of the API
+
+    def _aio_stub(self, macaroon_hex: str):
+        return lnrpc.LightningStub(grpc_pool.aio_pool.get(self.hostname,
+                                                          str(self.port),
+                                                          self.tls_cert.encode(),
+                                                          macaroon_hex.encode()))
+
+    async def acheck_alive_status(self):
+        if not self.is_enabled:
+            return False, 'disabled'
+
+        # noinspection PyBroadException
+        try:
+            error = (await self.aget_info()).get('error')
+            if error:
+                return False, error
+            return True, None
+        except Exception as err:
+            return False, err
+
+    async def aget_info(self) -> dict:
+        try:
+            request = lnrpc.rpc_pb2.GetInfoRequest()
+            response = await self._aio_stub(self._get_macaroon_readonly()).GetInfo(request)
+            return MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
+        except grpc.RpcError as err:
+            return {'error': 'Unable to process GetInfo with Exception:\n'
+                             'gRPC API Error: \n'
+                             '{}'.format(err)}
+        except Exception as err:
+            raise Exception("General Error: \n"
+                            "{}".format(err))
+
+    async def acreate_invoice(self, **kwargs) -> dict:
+        try:
+            request = lnrpc.rpc_pb2.Invoice(**kwargs)
+            response = await self._aio_stub(self._get_macaroon_invoice()).AddInvoice(request)
+            # send signal (receivers are sync)
+            await sync_to_async(lnnode_invoice_created.send)(sender=self.__class__, instance=self,
+                                                             payment_hash=response.r_hash)
+
+            return MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
+        except grpc.RpcError as err:
+            return {'error': 'Unable to process AddInvoice with Exception:\n'
+                             'gRPC API Error: \n'
+                             '{}'.format(err)}
+        except Exception as err:
+            raise Exception("General Error: \n"
+                            "{}".format(err))
+
+    async def aget_invoice(self, **kwargs) -> dict:
+        try:
+            r_hash = kwargs['r_hash'].tobytes()
+        except AttributeError:
+            r_hash = kwargs['r_hash']
+
+        try:
+            request = lnrpc.rpc_pb2.PaymentHash(r_hash=r_hash)
+            response = await self._aio_stub(self._get_macaroon_invoice()).LookupInvoice(request)
+            return MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
+        except grpc.RpcError as err:
+            return {'error': 'Unable to process LookupInvoice with Exception:\n'
+                             'gRPC API Error: \n'
+                             '{}'.format(err)}
+        except Exception as err:
+            raise Exception("General Error: \n"
+                            "{}".format(err))
+
+    async def astream_invoices(self, **kwargs):
+        # kwargs: add_index and/or settle_index to also receive the invoices that changed since then
+        request = lnrpc.rpc_pb2.InvoiceSubscription(**kwargs)
+        async for response in self._aio_stub(self._get_macaroon_invoice()).SubscribeInvoices(request):
+            yield MessageToDict(response, including_default_value_fields=True, preserving_proto_field_name=True)
+
     class Stub(lnrpc.LightningStub):
+        """LightningStub on a (shared) channel from the process-wide channel pool"""
+
         def __init__(self, host: str, port: str, tls_cert: bytes, macaroon_hex: bytes):
             self.host = host
             self.port = port
-            self.tls_cert = tls_cert
-            self.macaroon_hex = macaroon_hex
 
-            self.channel = self._get_rpc_channel()
+            self.channel = grpc_pool.pool.get(host, port, tls_cert, macaroon_hex)
             super().__init__(self.channel)
 
         def __enter__(self):
             return self
 
         def __exit__(self, exc_type, exc_value, traceback):
-            self.channel.close()
-
-        def _get_rpc_channel(self):
-            def metadata_callback(context, callback):
-                # for more info see grpc docs
-                callback([('macaroon', self.macaroon_hex)], None)
-
-            # Due to updated ECDSA generated tls.cert we need to let gprc know that
-            # we need to use that cipher suite otherwise there will be a handshake
-            # error when we communicate with the lnd rpc server.
-            os.environ["GRPC_SSL_CIPHER_SUITES"] = 'HIGH+ECDSA'
-
-            # build ssl credentials using the cert the same as before
-            cert_creds = grpc.ssl_channel_credentials(self.tls_cert)
-
-            # now build meta data credentials
-            auth_creds = grpc.metadata_call_credentials(metadata_callback)
-
-            # combine the cert credentials and the macaroon auth credentials
-            # such that every call is properly encrypted and authenticated
-            combined_creds = grpc.composite_channel_credentials(cert_creds, auth_creds)
-
-            # finally pass in the combined credentials when creating a channel
-            return grpc.secure_channel('{}:{}'.format(self.host, self.port), combined_creds)
+            pass  # the channel is shared - it is closed by the pool (on exit)
 
 
 class LndRestNode(LndNode):
@@ -368,28 +454,32 @@ class LndRestNode(LndNode):
         verbose_name = _("LND REST Node")
         verbose_name_plural = _("LND REST Nodes")
 
-    def create_invoice(self, **kwargs):
-        pass
+    @property
+    def base_url(self):
+        return f'https://{self.hostname}:{self.port}'
 
-    def _send_request(self, path='/v1/getinfo') -> dict:
-        url = f'https://{self.hostname}:{self.port}{path}'
+    @property
+    def session(self):
+        return http_pool.pool.get(self.base_url, self.tls_cert, self.tls_cert_verification)
 
-        session = requests.Session()
+    def _send_request(self, path='/v1/getinfo', method='GET', data=None, macaroon=None, timeout=3.0) -> dict:
+        url = f'{self.base_url}{path}'
 
-        try:
-            if self.tls_cert_verification:
-                adapter = CaDataVerifyingHTTPAdapter(tls_cert=self.tls_cert)
-                session.mount(url, adapter)
-                res = session.get(url,
-                                  headers={'Grpc-Metadata-macaroon': self.macaroon_readonly},
-                                  timeout=3.0)
+        if macaroon is None:
+            macaroon = self.macaroon_readonly
 
-            else:
-                requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-                res = session.get(url,
-                                  headers={'Grpc-Metadata-macaroon': self.macaroon_readonly},
-                                  verify=False,
-                                  timeout=3.0)
+        try:
+            res = self.session.request(method, url,
+                                       headers={'Grpc-Metadata-macaroon': macaroon},
+                                       json=data,
+                                       timeout=timeout)
+
+            if not res.ok:
+                try:
+                    message = res.json().get('message') or res.json().get('error')
+                except ValueError:
+                    message = res.text
+                return {'error': f'{res.status_code}: {message}'}
 
             return {'data': res.json()}
 
@@ -420,7 +510,12 @@ class LndRestNode(LndNode):
             error = err.args[0]
             print("Other error")
             print(error)
-            return {'error': error.reason}
+            return {'error': getattr(error, 'reason', error)}
+
+        except requests.exceptions.RequestException as err:
+            print("Other error")
+            print(err)
+            return {'error': err}
 
     def check_alive_status(self) -> (bool, str):
         if not self.is_enabled:
@@ -436,27 +531,45 @@ class LndRestNode(LndNode):
     def get_info(self) -> dict:
         return self._send_request().get('data')
 
-    def get_invoice(self, **kwargs):
-        pass
-
-    def stream_invoices(self, **kwargs):
-        raise NotImplementedError
+    def create_invoice(self, **kwargs) -> dict:
+        # kwargs as for gRPC (e.g. memo, value, expiry) - the response is the same (e.g. base64 encoded r_hash)
+        response = self._send_request('/v1/invoices', method='POST', data=kwargs,
+                                      macaroon=self._get_macaroon_invoice(), timeout=10.0)
+        if response.get('error'):
+            return {'error': 'Unable to process AddInvoice with Exception:\n'
+                             'REST API Error: \n'
+                             '{}'.format(response.get('error'))}
 
+        result = response.get('data')
+        # send signal
+        lnnode_invoice_created.send(sender=self.__class__, instance=self,
+                                    payment_hash=base64.b64decode(result.get('r_hash', '')))
+        return result
 
-class CaDataVerifyingHTTPAdapter(HTTPAdapter):
-    """
-    A TransportAdapter ...
-    """
+    def get_invoice(self, **kwargs) -> dict:
+        try:
+            r_hash = kwargs['r_hash'].tobytes()
+        except AttributeError:
+            r_hash = kwargs['r_hash']
 
-    def __init__(self, tls_cert, *args, **kwargs):
-        self.cadata = tls_cert
-        super().__init__(*args, **kwargs)
+        response = self._send_request(f'/v1/invoice/{r_hash.hex()}',
+                                      macaroon=self._get_macaroon_invoice(), timeout=10.0)
+        if response.get('error'):
+            return {'error': 'Unable to process LookupInvoice with Exception:\n'
+                             'REST API Error: \n'
+                             '{}'.format(response.get('error'))}
+        return response.get('data')
+
+    def list_invoices(self, **kwargs) -> dict:
+        # kwargs as for gRPC (index_offset and num_max_invoices) - the response is the same
+        query = '&'.join(f'{key}={value}' for key, value in kwargs.items())
+        response = self._send_request(f'/v1/invoices?{query}',
+                                      macaroon=self._get_macaroon_invoice(), timeout=10.0)
+        if response.get('error'):
+            return {'error': 'Unable to process ListInvoices with Exception:\n'
+                             'REST API Error: \n'
+                             '{}'.format(response.get('error'))}
+        return response.get('data')
 
-    def init_poolmanager(self, *args, **kwargs):
-        context = ssl.create_default_context()
-        context.load_verify_locations(cadata=self.cadata)
-        if hasattr(ssl, 'HAS_NEVER_CHECK_COMMON_NAME'):  # introduced in Python3.7
-            context.hostname_checks_common_name = False
-        context.check_hostname = False
-        kwargs['ssl_context'] = context
-        return super().init_poolmanager(*args, **kwargs)
+    def stream_invoices(self, **kwargs):
+        raise NotImplementedError
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class NodeRegistryEntry(models.Model):
+    """One row per Lightning Node (of any type) with the fields that are needed to list and select nodes.
+
+    Maintained by the post_save/post_delete receivers of the node models (see LnNodeConfig.ready) - the
+    primary key is the id of the node.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+
+    owner = models.ForeignKey(get_user_model(),
+                              on_delete=models.CASCADE,
+                              related_name='+')
+
+    priority = models.PositiveSmallIntegerField(default=0)
+    weight = models.PositiveSmallIntegerField(default=1)
+    is_enabled = models.BooleanField(default=True)
+    is_alive = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('priority', 'id')
+        verbose_name = _("Node Registry Entry")
+        verbose_name_plural = _("Node Registry Entries")
+        indexes = [
+            models.Index(fields=['owner', 'priority'], name='lnnode_registry_owner_idx'),
+        ]
+
+    def __str__(self):
+        return "Registry: {} ({})".format(self.id, self.content_type)
+
+    @classmethod
+    def sync_node(cls, node):
+        cls.objects.update_or_create(id=node.pk, defaults={
+            'content_type': ContentType.objects.get_for_model(node),
+            'owner_id': node.owner_id,
+            'priority': node.priority,
+            'weight': node.weight,
+            'is_enabled': node.is_enabled,
+            'is_alive': node.is_alive,
+        })
+
+    @classmethod
+    def load_nodes(cls, entries):
+        """the nodes of the entries (in the same order) - one query per node type"""
+        ids_by_type = defaultdict(list)
+        for entry in entries:
+            ids_by_type[entry.content_type_id].append(entry.id)
+
+        nodes = {}
+        for content_type_id, ids in ids_by_type.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            nodes.update(model._default_manager.in_bulk(ids))
+
+        return [nodes[entry.id] for entry in entries if entry.id in nodes]
+
+
+def sync_registry_node(sender, instance, **kwargs):
+    """post_save receiver for the node models"""
+    NodeRegistryEntry.sync_node(instance)
+
+
+def delete_registry_node(sender, instance, **kwargs):
+    """post_delete receiver for the node models"""
+    NodeRegistryEntry.objects.filter(id=instance.pk).delete()
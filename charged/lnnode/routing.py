@@ -0,0 +1,86 @@
+"""Per-owner routing table of the usable Lightning Nodes
+
+The routing table of an owner lists the enabled and alive nodes grouped in tiers by priority (the lower the
+better). It is built from the node registry (one query), cached and invalidated whenever a node of the owner
+is saved (this includes changes of the alive status) or deleted. get_nodes() yields the nodes in the order they
+should be tried: the nodes of the best tier first (ordered by CHARGED_LNNODE_ROUTING: 'round_robin' or
+'weighted'), then the next tier, ...
+"""
+import random
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from charged.lnnode.models import NodeRegistryEntry
+
+CACHE_KEY = 'lnnode.routing.{}'
+CACHE_TIMEOUT = 60 * 60  # invalidated on changes - only a safety net
+
+ROUND_ROBIN = 'round_robin'
+WEIGHTED = 'weighted'
+
+
+def get_routing_table(owner_id):
+    """[[(content type id, node id, weight), ...], ...] (tiers ordered by priority)"""
+    key = CACHE_KEY.format(owner_id)
+    table = cache.get(key)
+    if table is None:
+        entries = NodeRegistryEntry.objects.filter(owner_id=owner_id, is_enabled=True, is_alive=True)
+        table = [[(entry.content_type_id, str(entry.id), entry.weight) for entry in tier]
+                 for _, tier in groupby(entries, key=lambda entry: entry.priority)]
+        cache.set(key, table, timeout=CACHE_TIMEOUT)
+    return table
+
+
+def invalidate(owner_id):
+    cache.delete(CACHE_KEY.format(owner_id))
+
+
+def order_tier(owner_id, tier, strategy):
+    if len(tier) < 2:
+        return tier
+
+    if strategy == WEIGHTED:
+        # weighted random order without replacement (nodes with weight 0 last)
+        return sorted(tier, key=lambda ref: random.random() ** (1.0 / ref[2]) if ref[2] else -1, reverse=True)
+
+    # round robin: rotate by a counter per owner and tier
+    key = f'{CACHE_KEY.format(owner_id)}.{tier[0][1]}.rr'
+    try:
+        counter = cache.incr(key)
+    except ValueError:  # key does not exist (yet)
+        cache.set(key, 0, timeout=None)
+        counter = 0
+    offset = counter % len(tier)
+    return tier[offset:] + tier[:offset]
+
+
+def get_nodes(owner_id, strategy=None):
+    """the usable nodes of the owner in the order they should be tried (nodes are loaded lazily)"""
+    if strategy is None:
+        strategy = getattr(settings, 'CHARGED_LNNODE_ROUTING', ROUND_ROBIN)
+
+    for tier in get_routing_table(owner_id):
+        for content_type_id, node_id, _ in order_tier(owner_id, tier, strategy):
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            node = model._default_manager.filter(pk=node_id).first()
+            if node is None:  # deleted in the meantime
+                continue
+            yield node
+
+
+def update_nodes(queryset, **kwargs):
+    """queryset.update() - including the node registry and the routing tables (no signals are sent)"""
+    owner_ids = set(queryset.values_list('owner_id', flat=True))
+    rows_updated = queryset.update(**kwargs)
+    NodeRegistryEntry.objects.filter(id__in=queryset.values('pk')).update(**kwargs)
+    for owner_id in owner_ids:
+        invalidate(owner_id)
+    return rows_updated
+
+
+def invalidate_node(sender, instance, **kwargs):
+    """post_save/post_delete receiver for the node models"""
+    invalidate(instance.owner_id)
@@ -1,7 +1,12 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
-from charged.lnnode.models import get_all_nodes
+from charged.lnnode import grpc_pool, routing
+from charged.lnnode.models import get_all_nodes, get_node
 from charged.utils import handle_obj_is_alive_change
 
 logger = get_task_logger(__name__)
@@ -11,30 +16,68 @@ class LnNodeNotFoundError(Exception):
     pass
 
 
+async def probe_nodes(nodes, timeout, deadline):
+    """check the alive status of the nodes concurrently
+
+    Each node gets up to timeout seconds. Nodes that have no result after deadline seconds are not
+    included in the result: {node_id: (status, info, latency)}
+    """
+
+    async def probe(node):
+        start = time.monotonic()
+        try:
+            status, info = await asyncio.wait_for(node.acheck_alive_status(), timeout)
+        except asyncio.TimeoutError:
+            status, info = False, f'timeout ({timeout}s)'
+        except Exception as err:
+            status, info = False, err
+        return status, info, time.monotonic() - start
+
+    tasks = {node_id: asyncio.ensure_future(probe(node)) for node_id, node in nodes}
+    try:
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)  # returns at once (threads of hung checks are not waited for)
+    finally:
+        # aio channels are bound to this event loop
+        await grpc_pool.aio_pool.shutdown()
+
+    return {node_id: task.result() for node_id, task in tasks.items() if task in done}
+
+
 @shared_task(bind=True, ignore_result=True)
-def node_alive_check(self, obj_id=None):
+def node_alive_check(self, obj_id=None, timeout=5, deadline=20):
     # checks
-    all_nodes = get_all_nodes()
-
     if obj_id:
-        try:
-            all_nodes_dict = dict(all_nodes)
-            node = all_nodes_dict[obj_id]
-            logger.info('Running on Node: %s' % node)
-            status, info = node.check_alive_status()
-            logger.debug('check_alive result: %s %s' % (status, info))
-            if node.is_alive != status:
-                handle_obj_is_alive_change(node, status)
-
-        except KeyError:
+        node = get_node(obj_id)
+        if not node:
             logger.info('Not found')
             raise LnNodeNotFoundError()
-
+        nodes = [(str(node.pk), node)]
     else:
-        for node_id, node in all_nodes:
-            logger.info('Running on Node: %s' % node)
-            status, info = node.check_alive_status()
-            logger.debug('check_alive result: %s %s' % (status, info))
-            if node.is_alive != status:
-                if node.is_alive != status:
-                    handle_obj_is_alive_change(node, status)
+        nodes = get_all_nodes()
+
+    # threaded checks (see BaseLnNode.acheck_alive_status) run in a dedicated executor that is not waited for
+    # (asyncio.run would wait for hung checks and miss the deadline)
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(thread_name_prefix='node_alive_check'))
+    try:
+        results = loop.run_until_complete(probe_nodes(nodes, timeout, deadline))
+    finally:
+        loop.close()  # shuts the default executor down with wait=False
+
+    for node_id, node in nodes:
+        if node_id not in results:
+            logger.warning('No check_alive result within %ss for Node: %s - skipping' % (deadline, node))
+            continue
+
+        status, info, latency = results[node_id]
+        node.probe_latency = latency
+        logger.debug('check_alive result: %s %s (%.3fs) for Node: %s' % (status, info, latency, node))
+        if node.is_alive != status:
+            # don't use save() - that would run another (blocking) alive check (see BaseLnNode.save)
+            node.is_alive = status
+            routing.update_nodes(type(node).objects.filter(pk=node.pk), is_alive=status)
+            handle_obj_is_alive_change(node, status)
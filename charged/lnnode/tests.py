@@ -0,0 +1,209 @@
+import asyncio
+import base64
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import SimpleTestCase, TestCase
+
+from charged.lnnode import http_pool, routing
+from charged.lnnode.grpc_pool import ChannelPool
+from charged.lnnode.models import FakeNode, LndRestNode, NodeRegistryEntry, get_all_nodes, get_node
+from charged.lnnode.tasks import node_alive_check
+
+
+def create_owner():
+    owner = get_user_model().objects.create(username='owner', is_staff=True)
+    # change log entries are written for user_id=1
+    get_user_model().objects.get_or_create(pk=1, defaults={'username': 'admin'})
+    return owner
+
+
+class ChannelPoolTest(SimpleTestCase):
+    def test_channels_are_shared_per_node_and_credentials(self):
+        pool = ChannelPool()
+
+        channel = pool.get('localhost', '10009', b'cert', b'macaroon')
+        self.assertIs(pool.get('localhost', 10009, b'cert', b'macaroon'), channel)
+        self.assertIsNot(pool.get('localhost', '10009', b'cert', b'other macaroon'), channel)
+        self.assertIsNot(pool.get('localhost', '10009', b'other cert', b'macaroon'), channel)
+        self.assertEqual(len(pool), 3)
+
+        pool.shutdown()
+        self.assertEqual(len(pool), 0)
+        self.assertIsNot(pool.get('localhost', '10009', b'cert', b'macaroon'), channel)
+        pool.shutdown()
+
+
+class AsyncNodeApiTest(SimpleTestCase):
+    def setUp(self):
+        self.node = FakeNode(owner=get_user_model()(username='owner'))
+
+    def test_sync_api_is_run_in_threads_by_default(self):
+        async def run():
+            return await asyncio.gather(self.node.acheck_alive_status(),
+                                        self.node.aget_info(),
+                                        self.node.aget_invoice(r_hash=b'\x01'))
+
+        self.assertEqual(async_to_sync(run)(), [(True, ''),
+                                                {'method': 'get_info', 'foo': 'bar'},
+                                                {'method': 'get_invoice', 'foo': 'bar'}])
+
+    def test_stream_invoices(self):
+        async def run():
+            return [x async for x in self.node.astream_invoices()]
+
+        with mock.patch.object(FakeNode, 'stream_invoices', return_value=iter([{'settled': False},
+                                                                                {'settled': True}])):
+            self.assertEqual(async_to_sync(run)(), [{'settled': False}, {'settled': True}])
+
+
+class NodeAliveCheckTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        owner.email = 'owner@example.com'
+        owner.save()
+        self.fast = FakeNode.objects.create(owner=owner, name='fast')
+        self.slow = FakeNode.objects.create(owner=owner, name='slow')
+
+    def test_nodes_are_probed_concurrently_with_timeout(self):
+        async def slow_check():
+            await asyncio.sleep(2)
+            return True, ''
+
+        self.slow.acheck_alive_status = slow_check
+        nodes = [(str(self.fast.id), self.fast), (str(self.slow.id), self.slow)]
+
+        with mock.patch('charged.lnnode.tasks.get_all_nodes', return_value=nodes), \
+                mock.patch.object(FakeNode, 'check_alive_status', return_value=(True, '')) as check_alive_status:
+            start = time.monotonic()
+            node_alive_check(timeout=0.2)
+            self.assertLess(time.monotonic() - start, 1)
+
+        # only the probe of the fast node - the change was written without save() (no second, blocking check)
+        check_alive_status.assert_called_once_with()
+        self.assertEqual([(x.name, x.is_alive) for x in FakeNode.objects.order_by('name')],
+                         [('fast', True), ('slow', False)])
+        self.assertFalse(NodeRegistryEntry.objects.get(id=self.slow.id).is_alive)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertLess(self.fast.probe_latency, 0.2)
+        self.assertGreaterEqual(self.slow.probe_latency, 0.2)
+
+    def test_hung_threaded_check_does_not_delay_the_deadline(self):
+        def hung_check():
+            time.sleep(2)
+            return True, ''
+
+        self.slow.check_alive_status = hung_check  # run in a thread by BaseLnNode.acheck_alive_status
+        nodes = [(str(self.slow.id), self.slow)]
+
+        with mock.patch('charged.lnnode.tasks.get_all_nodes', return_value=nodes):
+            start = time.monotonic()
+            node_alive_check(timeout=5, deadline=0.2)
+            self.assertLess(time.monotonic() - start, 1)
+
+        self.assertTrue(FakeNode.objects.get(pk=self.slow.pk).is_alive)  # no result - unchanged
+
+
+class NodeRoutingTest(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.first = FakeNode.objects.create(owner=self.owner, name='first', priority=0)
+        self.second = FakeNode.objects.create(owner=self.owner, name='second', priority=0)
+        self.backup = FakeNode.objects.create(owner=self.owner, name='backup', priority=1)
+        FakeNode.objects.create(owner=self.owner, name='disabled', priority=0, is_enabled=False)
+
+    def get_names(self, strategy=routing.ROUND_ROBIN):
+        return [node.name for node in routing.get_nodes(self.owner.id, strategy=strategy)]
+
+    def test_round_robin_within_priority_tier(self):
+        names = [self.get_names() for _ in range(2)]
+
+        self.assertEqual(sorted(names[0][:2]), ['first', 'second'])
+        self.assertEqual(names[1][:2], names[0][1::-1])
+        self.assertEqual([x[2] for x in names], ['backup', 'backup'])
+
+    def test_weighted(self):
+        self.first.weight = 0
+        self.first.save()
+        self.assertEqual([self.get_names(strategy=routing.WEIGHTED) for _ in range(5)],
+                         [['second', 'first', 'backup']] * 5)
+
+    def test_routing_table_is_cached_until_a_node_changes(self):
+        routing.get_routing_table(self.owner.id)
+        with self.assertNumQueries(0):
+            routing.get_routing_table(self.owner.id)
+
+        self.second.is_enabled = False
+        self.second.save()
+        self.assertEqual(len(routing.get_routing_table(self.owner.id)[0]), 1)
+
+
+class NodeRegistryTest(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.backup = FakeNode.objects.create(owner=self.owner, name='backup', priority=1)
+        self.first = FakeNode.objects.create(owner=self.owner, name='first', priority=0)
+
+    def test_registry_follows_node_changes(self):
+        self.first.priority = 2
+        self.first.save()
+        self.assertEqual(NodeRegistryEntry.objects.get(id=self.first.id).priority, 2)
+
+        self.first.delete()
+        self.assertEqual(list(NodeRegistryEntry.objects.values_list('id', flat=True)), [self.backup.id])
+
+    def test_get_all_nodes_sorted_by_priority(self):
+        with self.assertNumQueries(2):
+            nodes = get_all_nodes(self.owner.id)
+        self.assertEqual(nodes, [(str(self.first.id), self.first), (str(self.backup.id), self.backup)])
+        self.assertEqual(get_all_nodes(self.owner.id + 1), [])
+
+    def test_get_node(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(get_node(str(self.backup.id)), self.backup)
+        self.assertIsNone(get_node('00000000-0000-0000-0000-000000000000'))
+
+
+class LndRestNodeTest(SimpleTestCase):
+    def setUp(self):
+        self.node = LndRestNode(hostname='node.example', port=8080, tls_cert_verification=False,
+                                macaroon_invoice='abcd', owner=get_user_model()(username='owner'))
+
+    def test_sessions_are_shared_per_node_configuration(self):
+        pool = http_pool.SessionPool()
+
+        session = pool.get(self.node.base_url, None, False)
+        self.assertIs(pool.get(self.node.base_url, None, False), session)
+        self.assertIsNot(pool.get(self.node.base_url, 'other cert', False), session)
+        self.assertIsNot(pool.get('https://other.example:8080', None, False), session)
+
+        pool.shutdown()
+        self.assertEqual(len(pool), 0)
+
+    def test_create_and_get_invoice(self):
+        r_hash = b'\x01' * 32
+        session = mock.Mock()
+        session.request.return_value.ok = True
+
+        with mock.patch.object(http_pool.pool, 'get', return_value=session):
+            session.request.return_value.json.return_value = {'r_hash': base64.b64encode(r_hash).decode(),
+                                                              'payment_request': 'lnbc1'}
+            result = self.node.create_invoice(memo='test', value=25, expiry=900)
+            self.assertEqual(result['payment_request'], 'lnbc1')
+            session.request.assert_called_with('POST', 'https://node.example:8080/v1/invoices',
+                                               headers={'Grpc-Metadata-macaroon': 'abcd'},
+                                               json={'memo': 'test', 'value': 25, 'expiry': 900},
+                                               timeout=10.0)
+
+            session.request.return_value.json.return_value = {'settled': True}
+            self.assertEqual(self.node.get_invoice(r_hash=memoryview(r_hash)), {'settled': True})
+            self.assertEqual(session.request.call_args[0][1],
+                             f'https://node.example:8080/v1/invoice/{r_hash.hex()}')
+
+            session.request.return_value.ok = False
+            session.request.return_value.status_code = 404
+            session.request.return_value.json.return_value = {'message': 'unable to locate invoice'}
+            self.assertIn('404: unable to locate invoice', self.node.get_invoice(r_hash=r_hash)['error'])
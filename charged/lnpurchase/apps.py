@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -6,3 +7,13 @@ class LnPurchaseConfig(AppConfig):
     name = 'charged.lnpurchase'
     label = 'lnpurchase'
     verbose_name = _('Charged Lightning Purchase')
+
+    def ready(self):
+        from charged.lnpurchase import models, signals
+
+        # keep the denormalized owner and total price of the purchase orders up to date
+        post_save.connect(signals.update_purchase_order_from_items, sender=models.PurchaseOrderItemDetail)
+        post_delete.connect(signals.update_purchase_order_from_items, sender=models.PurchaseOrderItemDetail)
+
+        # initialize the owner and total price of existing purchase orders
+        post_migrate.connect(signals.update_purchase_orders_from_items, sender=self)
@@ -0,0 +1,83 @@
+import statistics
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from charged.lnnode.models import FakeNode
+from charged.lnpurchase.models import PurchaseOrder, PurchaseOrderItemDetail
+from charged.lnpurchase.tasks import process_initial_purchase_order
+from shop.models import Host, TorBridge
+
+
+class Rollback(Exception):
+    """Used to roll back the seeded data"""
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark process_initial_purchase_order (queries and wall time per order) on seeded orders. ' \
+           'Everything runs in a transaction that is rolled back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help='Number of purchase orders to process')
+        parser.add_argument('--show-queries', action='store_true', help='Print the queries of the first order')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                orders = self.seed(options['orders'])
+                self.run(orders, options['show_queries'])
+                raise Rollback
+
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Done (seeded data was rolled back).'))
+
+    def seed(self, orders):
+        self.stdout.write(f'Seeding {orders} purchase orders...')
+        now = timezone.now()
+
+        owner = get_user_model().objects.create(username=f'benchmark-{now.timestamp()}', is_staff=True)
+        host = Host.objects.create(ip='198.51.100.1', name=f'bench{now.timestamp():.0f}', owner=owner)
+        FakeNode.objects.create(owner=owner, name='benchmark')
+
+        # bulk_create: no signals (the orders are processed below and not by the workers)
+        bridges = TorBridge.objects.bulk_create([
+            # a whitelisted target port - the remote (https) check is not part of the benchmark
+            TorBridge(host=host, port=10000 + i, target='benchmark.onion:9735') for i in range(orders)
+        ], batch_size=1000)
+        # owner and total are maintained by the item signals - set them here
+        pos = PurchaseOrder.objects.bulk_create([PurchaseOrder(owner=owner, total_msat=1000) for _ in range(orders)],
+                                                batch_size=1000)
+        PurchaseOrderItemDetail.objects.bulk_create([
+            PurchaseOrderItemDetail(po=po, product=bridge, price=1000, quantity=1) for po, bridge in zip(pos, bridges)
+        ], batch_size=1000)
+
+        return [po.pk for po in pos]
+
+    def run(self, orders, show_queries):
+        queries, durations = [], []
+
+        # the tasks of the new invoices are queued on commit (never, as everything is rolled back) - no broker needed
+        with mock.patch('charged.lnpurchase.tasks.ensure_https', return_value=True):
+            for obj_id in orders:
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    process_initial_purchase_order(obj_id)
+                    durations.append(time.perf_counter() - start)
+                queries.append(len(ctx.captured_queries))
+
+                if show_queries and len(queries) == 1:
+                    for query in ctx.captured_queries:
+                        self.stdout.write(query['sql'])
+
+        processed = PurchaseOrder.objects.filter(pk__in=orders, status=PurchaseOrder.NEEDS_TO_BE_PAID).count()
+        self.stdout.write(self.style.MIGRATE_HEADING(f'process_initial_purchase_order ({len(orders)} orders, '
+                                                     f'{processed} set to NEEDS_TO_BE_PAID)'))
+        self.stdout.write(f'{"queries per order (median/max)":<40} {statistics.median(queries):>9.0f} {max(queries):>9}')
+        self.stdout.write(f'{"ms per order (median/mean)":<40} {statistics.median(durations) * 1000:>9.3f} '
+                          f'{statistics.mean(durations) * 1000:>9.3f}')
@@ -1,8 +1,10 @@
 import uuid
 
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import F, Sum
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
@@ -66,22 +68,59 @@ class PurchaseOrder(models.Model):
         verbose_name=_('Message to Customer')
     )
 
+    # denormalized from the item details (maintained by update_from_items)
+    owner = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.SET_NULL,
+        editable=False,
+        null=True, blank=True,
+        verbose_name=_('Owner'),
+        help_text=_('Owner of the host of the items.')
+    )
+
+    total_msat = models.BigIntegerField(
+        verbose_name=_('Total price (in milli-satoshi)'),
+        editable=False,
+        default=0
+    )
+
+    DENORMALIZED_FIELDS = ('owner', 'total_msat')
+
     class Meta:
         ordering = ['-created_at']
         verbose_name = _("Purchase Order")
         verbose_name_plural = _("Purchase Orders")
+        indexes = [
+            models.Index(fields=['status'], name='lnpurchase_po_status_idx'),
+        ]
 
     def __str__(self):
         return "PO ({})".format(self.id)
 
-    @property
-    def owner(self):
-        return self.owner_from_items_host()
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('update_fields'):
+            # owner and total are updated by the item details - don't overwrite them with stale values
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in self.DENORMALIZED_FIELDS]
+
+        super().save(*args, **kwargs)
+
+    def update_from_items(self):
+        """recalculate the owner and total price from the item details (call after they changed)"""
+        items = self.item_details.all()
+        self.total_msat = items.aggregate(total=Sum(F('quantity') * F('price')))['total'] or 0
+        try:
+            self.owner = self.owner_from_items_host(items.prefetch_related('product__host__owner'))
+        except RuntimeError:
+            self.owner = None
+
+        PurchaseOrder.objects.filter(pk=self.pk).update(owner=self.owner, total_msat=self.total_msat)
 
-    def owner_from_items_host(self):
+    def owner_from_items_host(self, i_details=None):
         owner = set()
 
-        i_details = self.item_details.all()
+        if i_details is None:
+            i_details = self.item_details.all()
         if not i_details:
             raise RuntimeError("No item details in PO!")  # ToDo(frennkie) How to handle this?!
 
@@ -94,17 +133,11 @@ class PurchaseOrder(models.Model):
 
     @property
     def total_price_msat(self):
-        total = 0
-        for item in self.item_details.all():
-            total += item.quantity * item.price
-        return "{:.0f}".format(total)
+        return "{:.0f}".format(self.total_msat)
 
     @property
     def total_price_sat(self):
-        total = 0
-        for item in self.item_details.all():
-            total += item.quantity * item.price / 1000.0
-        return "{:.0f}".format(total)
+        return "{:.0f}".format(self.total_msat / 1000.0)
 
     @cached_property
     def poi(self):
@@ -0,0 +1,14 @@
+from charged.lnpurchase.models import PurchaseOrder
+
+
+def update_purchase_order_from_items(sender, instance, **kwargs):
+    """keep the owner and total price of the purchase order up to date when its item details change"""
+    if kwargs.get('raw'):
+        return  # loaddata
+    instance.po.update_from_items()
+
+
+def update_purchase_orders_from_items(sender, **kwargs):
+    """initialize the owner and total price of existing purchase orders"""
+    for po in PurchaseOrder.objects.filter(owner__isnull=True, item_details__isnull=False).distinct():
+        po.update_from_items()
@@ -5,13 +5,15 @@ import pycurl
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from djmoney.money import Money
 
 from charged.lninvoice.models import PurchaseOrderInvoice
-from charged.lnnode.models import get_all_nodes
+from charged.lnnode import routing
 from charged.lnpurchase.models import PurchaseOrder
 from charged.lnrates.models import FiatRate
-from charged.utils import add_change_log_entry
+from charged.utils import add_change_log_entry, buffered_change_log
 from shop.models import TorDenyList
 
 logger = get_task_logger(__name__)
@@ -49,140 +51,199 @@ def ensure_https(url):
         c.close()
 
 
-@shared_task()
-def process_initial_purchase_order(obj_id):
-    logger.info('Running on ID: %s' % obj_id)
+class PurchaseOrderChangedError(Exception):
+    """Purchase Order was changed while it was processed"""
+    pass
 
-    # checks
-    obj: PurchaseOrder = PurchaseOrder.objects \
-        .filter(id=obj_id) \
-        .filter(status=PurchaseOrder.INITIAL) \
-        .first()
 
-    if not obj:
-        logger.info('Not found')
-        return None
+class PurchaseOrderProcessor:
+    """State machine for new purchase orders (INITIAL -> NEEDS_TO_BE_PAID or REJECTED)
 
-    if not obj.total_price_msat:
-        logger.info('No total price - skipping: %s' % obj)
-        return None
+    The transitions are made in memory (each handler sets the next status) and written with a single
+    update (plus the pending change log entries) when the order is committed: before a slow remote
+    check, together with the new invoice and at the end.
+    """
 
-    logger.debug('set to: NEEDS_LOCAL_CHECKS')
-    obj.status = PurchaseOrder.NEEDS_LOCAL_CHECKS
-    obj.save()
-    add_change_log_entry(obj, 'set to: NEEDS_LOCAL_CHECKS')
-
-    # ToDo(frennkie) this should not live in Django Charged
-    bridge_host = obj.item_details.first().product.host
-    if not bridge_host.is_enabled:
-        logger.info('Bridge Host is disabled: %s' % bridge_host)
-        obj.status = PurchaseOrder.REJECTED
-        obj.message = "Bridge Host is disabled"
-        obj.save()
-        add_change_log_entry(obj, 'set to: REJECTED')
-        return None
+    HANDLERS = {
+        PurchaseOrder.INITIAL: 'start',
+        PurchaseOrder.NEEDS_LOCAL_CHECKS: 'local_checks',
+        PurchaseOrder.NEEDS_REMOTE_CHECKS: 'remote_checks',
+        PurchaseOrder.NEEDS_INVOICE: 'create_invoice',
+    }
 
-    # ToDo(frennkie) this should not live in Django Charged
-    target_with_port = obj.item_details.first().product.target
-    try:
-        target = target_with_port.split(':')[0]
-    except IndexError:
-        target = target_with_port
+    STATUS_NAMES = {
+        PurchaseOrder.NEEDS_LOCAL_CHECKS: 'NEEDS_LOCAL_CHECKS',
+        PurchaseOrder.NEEDS_REMOTE_CHECKS: 'NEEDS_REMOTE_CHECKS',
+        PurchaseOrder.NEEDS_INVOICE: 'NEEDS_INVOICE',
+        PurchaseOrder.NEEDS_TO_BE_PAID: 'NEEDS_TO_BE_PAID',
+        PurchaseOrder.REJECTED: 'REJECTED',
+    }
 
-    try:
-        target_port = target_with_port.split(':')[1]
-    except IndexError:
-        target_port = 80
-
-    if TorDenyList.objects.filter(is_denied=True).filter(target=target):
-        logger.info('Target is on Deny List: %s' % target)
-        obj.status = PurchaseOrder.REJECTED
-        obj.message = "Target is on Deny List"
-        obj.save()
-        add_change_log_entry(obj, 'set to: REJECTED')
-        return None
+    # ToDo(frennkie) move to settings (env)
+    WHITELISTED_SERVICE_PORTS = ['8333', '9735']
+
+    def __init__(self, obj: PurchaseOrder):
+        self.obj = obj
+        self.committed_status = obj.status
+        self.pending_log = []
+        self.invoice = None
+
+    @classmethod
+    def load(cls, obj_id):
+        obj = PurchaseOrder.objects \
+            .filter(id=obj_id) \
+            .filter(status=PurchaseOrder.INITIAL) \
+            .select_related('owner') \
+            .prefetch_related('item_details__product__host') \
+            .first()
+
+        if not obj:
+            return None
+        return cls(obj)
+
+    @property
+    def product(self):
+        # ToDo(frennkie) this should not live in Django Charged
+        return self.obj.item_details.all()[0].product  # prefetched (first() would query again)
+
+    def set_status(self, status, message=None):
+        logger.debug('set to: %s' % self.STATUS_NAMES[status])
+        self.obj.status = status
+        if message:
+            self.obj.message = message
+        self.pending_log.append(f'set to: {self.STATUS_NAMES[status]}')
+
+    def commit(self):
+        if self.obj.status == self.committed_status:
+            return
+
+        updated = PurchaseOrder.objects \
+            .filter(id=self.obj.id, status=self.committed_status) \
+            .update(status=self.obj.status, message=self.obj.message, modified_at=timezone.now())
+        if not updated:
+            raise PurchaseOrderChangedError(f'{self.obj} is not in status {self.committed_status} anymore')
+
+        for message in self.pending_log:
+            add_change_log_entry(self.obj, message)
+        self.committed_status = self.obj.status
+        self.pending_log = []
+
+    def run(self):
+        while self.obj.status in self.HANDLERS:
+            getattr(self, self.HANDLERS[self.obj.status])()
+        self.commit()
+
+    def start(self):
+        self.set_status(PurchaseOrder.NEEDS_LOCAL_CHECKS)
+
+    def local_checks(self):
+        bridge_host = self.product.host
+        if not bridge_host.is_enabled:
+            logger.info('Bridge Host is disabled: %s' % bridge_host)
+            self.set_status(PurchaseOrder.REJECTED, "Bridge Host is disabled")
+            return
+
+        target, _ = self.get_target()
+        if TorDenyList.objects.filter(is_denied=True).filter(target=target).exists():
+            logger.info('Target is on Deny List: %s' % target)
+            self.set_status(PurchaseOrder.REJECTED, "Target is on Deny List")
+            return
+
+        self.set_status(PurchaseOrder.NEEDS_REMOTE_CHECKS)
+
+    def remote_checks(self):
+        target, target_port = self.get_target()
+        if target_port in self.WHITELISTED_SERVICE_PORTS:
+            logger.info('REMOTE CHECKS: target port is whitelisted: %s' % target_port)
+
+        else:
+            self.commit()  # the check may take a while
+
+            url = f'https://{target}:{target_port}/'
+            result = ensure_https(url)
+            if not result:
+                logger.info('REMOTE CHECKS: Target is not HTTPS')
+                self.set_status(PurchaseOrder.REJECTED, "Target is not HTTPS")
+                return
+
+        self.set_status(PurchaseOrder.NEEDS_INVOICE)
+
+    def create_invoice(self):
+        obj = self.obj
+
+        # ToDo(frennkie) check this!
+        node = next(routing.get_nodes(obj.owner_id), None)  # only enabled and alive nodes
+        if not node:
+            self.commit()
+            raise RuntimeError("no owned nodes found")
 
-    logger.debug('set to: NEEDS_REMOTE_CHECKS')
-    obj.status = PurchaseOrder.NEEDS_REMOTE_CHECKS
-    obj.save()
-    add_change_log_entry(obj, 'set to: NEEDS_REMOTE_CHECKS')
+        invoice = PurchaseOrderInvoice(label="PO: {}".format(obj.id),
+                                       msatoshi=obj.total_price_msat,
+                                       tax_rate=Decimal.from_float(getattr(settings, 'CHARGED_TAX_RATE')),
+                                       tax_currency_ex_rate=get_ex_rate(FiatRate.EUR),
+                                       info_currency_ex_rate=get_ex_rate(FiatRate.USD),
+                                       lnnode=node)
 
-    # ToDo(frennkie) move to settings (env)
-    whitelisted_service_ports = ['8333', '9735']
-    if target_port in whitelisted_service_ports:
-        logger.info('REMOTE CHECKS: target port is whitelisted: %s' % target_port)
+        with transaction.atomic():
+            invoice.save()
+            add_change_log_entry(invoice, f'created poi for po: {obj.id}')
 
-    else:
-        url = f'https://{target}:{target_port}/'
-        result = ensure_https(url)
-        if not result:
-            logger.info('REMOTE CHECKS: Target is not HTTPS')
-            obj.status = PurchaseOrder.REJECTED
-            obj.message = "Target is not HTTPS"
-            obj.save()
-            add_change_log_entry(obj, 'set to: REJECTED')
-            return None
+            obj.ln_invoices.add(invoice)
+            self.pending_log.append(f'added new poi: {invoice.id}')
 
-    logger.debug('set to: NEEDS_INVOICE')
-    obj.status = PurchaseOrder.NEEDS_INVOICE
-    obj.save()
-    add_change_log_entry(obj, 'set to: NEEDS_INVOICE')
+            self.set_status(PurchaseOrder.NEEDS_TO_BE_PAID)
+            self.commit()
 
-    tax_ex_rate_obj = FiatRate.objects \
-        .filter(is_aggregate=False) \
-        .filter(fiat_symbol=FiatRate.EUR) \
-        .first()
+        logger.info('Created LnInvoice: %s (%s)' % (invoice.id, invoice))
+        self.invoice = invoice
 
-    if tax_ex_rate_obj:
-        tax_ex_rate = tax_ex_rate_obj.rate
-    else:
-        tax_ex_rate = Money(0.00, getattr(settings, 'CHARGED_TAX_CURRENCY_FIAT'))
+    def get_target(self):
+        target_with_port = self.product.target
+        try:
+            target = target_with_port.split(':')[0]
+        except IndexError:
+            target = target_with_port
 
-    info_ex_rate_obj = FiatRate.objects \
-        .filter(is_aggregate=False) \
-        .filter(fiat_symbol=FiatRate.USD) \
-        .first()
+        try:
+            target_port = target_with_port.split(':')[1]
+        except IndexError:
+            target_port = 80
 
-    if info_ex_rate_obj:
-        info_ex_rate = info_ex_rate_obj.rate
-    else:
-        info_ex_rate = Money(0.00, getattr(settings, 'CHARGED_TAX_CURRENCY_FIAT'))
+        return target, target_port
 
-    # ToDo(frennkie) check this!
-    owned_nodes = get_all_nodes(obj.owner.id)
-    for node_tuple in owned_nodes:
-        node = node_tuple[1]
 
-        if not node.is_enabled:
-            continue  # skip disabled nodes
-        if not node.is_alive:
-            continue  # skip dead nodes
+def get_ex_rate(fiat_symbol):
+    ex_rate_obj = FiatRate.objects \
+        .filter(is_aggregate=False) \
+        .filter(fiat_symbol=fiat_symbol) \
+        .first()
 
-        invoice = PurchaseOrderInvoice(label="PO: {}".format(obj.id),
-                                       msatoshi=obj.total_price_msat,
-                                       tax_rate=Decimal.from_float(getattr(settings, 'CHARGED_TAX_RATE')),
-                                       tax_currency_ex_rate=tax_ex_rate,
-                                       info_currency_ex_rate=info_ex_rate,
-                                       lnnode=node)
+    if ex_rate_obj:
+        return ex_rate_obj.rate
+    return Money(0.00, getattr(settings, 'CHARGED_TAX_CURRENCY_FIAT'))
 
-        invoice.save()
-        add_change_log_entry(invoice, f'created poi for po: {obj.id}')
 
-        obj.ln_invoices.add(invoice)
-        add_change_log_entry(obj, f'added new poi: {invoice.id}')
+@shared_task()
+@buffered_change_log()
+def process_initial_purchase_order(obj_id):
+    logger.info('Running on ID: %s' % obj_id)
 
-        obj.status = PurchaseOrder.NEEDS_TO_BE_PAID
-        obj.save()
-        add_change_log_entry(obj, 'set to: NEEDS_TO_BE_PAID')
+    # checks
+    processor = PurchaseOrderProcessor.load(obj_id)
+    if not processor:
+        logger.info('Not found')
+        return None
 
-        logger.info('Created LnInvoice: %s (%s)' % (invoice.id, invoice))
+    if not processor.obj.total_price_msat:
+        logger.info('No total price - skipping: %s' % processor.obj)
+        return None
 
-        break
+    processor.run()
 
-    else:
-        raise RuntimeError("no owned nodes found")
+    if processor.obj.status == PurchaseOrder.REJECTED:
+        return None
 
-    if invoice:
-        return invoice.id
+    if processor.invoice:
+        return processor.invoice.id
     else:
         raise NoInvoiceCreatedError
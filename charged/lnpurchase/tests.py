@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from charged.lnnode.models import FakeNode
+from charged.lnpurchase.models import PurchaseOrder, PurchaseOrderItemDetail
+from charged.lnpurchase.tasks import process_initial_purchase_order
+from shop.models import Host, ShopPurchaseOrder, TorBridge, TorDenyList
+
+
+def create_owner():
+    owner = get_user_model().objects.create(username='owner', is_staff=True)
+    # change log entries are written for user_id=1
+    get_user_model().objects.get_or_create(pk=1, defaults={'username': 'admin'})
+    return owner
+
+
+@mock.patch('shop.signals.process_initial_purchase_order')
+class PurchaseOrderTotalsTest(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=self.owner, tor_bridge_price_initial=25000)
+
+    def test_owner_and_total_follow_the_items(self, process_initial_purchase_order):
+        po = ShopPurchaseOrder.tor_bridges.create(host=self.host, target='example.onion:80')
+
+        po = PurchaseOrder.objects.get(pk=po.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual((po.owner, po.total_price_msat, po.total_price_sat), (self.owner, '25000', '25'))
+
+        bridge = TorBridge.objects.create(host=self.host, port=20001, target='example.onion:80')
+        item = PurchaseOrderItemDetail.objects.create(po=po, product=bridge, price=1500, quantity=2)
+        po.refresh_from_db()
+        self.assertEqual(po.total_msat, 28000)
+
+        item.delete()
+        po.item_details.all().delete()  # queryset delete sends post_delete as well
+        po.refresh_from_db()
+        self.assertEqual((po.owner, po.total_msat), (None, 0))
+
+    def test_stale_instance_does_not_overwrite_totals(self, process_initial_purchase_order):
+        po = PurchaseOrder.objects.create()
+        stale = PurchaseOrder.objects.get(pk=po.pk)
+
+        bridge = TorBridge.objects.create(host=self.host, port=20001, target='example.onion:80')
+        PurchaseOrderItemDetail.objects.create(po=po, product=bridge, price=1000, quantity=1)
+        stale.status = PurchaseOrder.REJECTED
+        stale.save()
+
+        po.refresh_from_db()
+        self.assertEqual((po.status, po.owner, po.total_msat), (PurchaseOrder.REJECTED, self.owner, 1000))
+
+
+@mock.patch('shop.signals.process_initial_lni')
+class ProcessInitialPurchaseOrderTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.node = FakeNode.objects.create(owner=owner)
+        host = Host.objects.create(ip='192.0.2.1', owner=owner)
+
+        with mock.patch('shop.signals.process_initial_purchase_order'):
+            self.po = PurchaseOrder.objects.create()
+        bridge = TorBridge.objects.create(host=host, port=20000, target='example.onion:9735')
+        PurchaseOrderItemDetail.objects.create(po=self.po, product=bridge, price=1000, quantity=1)
+
+    def get_log(self):
+        return list(LogEntry.objects.filter(object_id=str(self.po.pk)).order_by('pk')
+                    .values_list('change_message', flat=True))
+
+    def test_order_needs_to_be_paid(self, process_initial_lni):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice_id = process_initial_purchase_order(self.po.pk)
+
+        self.po.refresh_from_db()
+        self.assertEqual(self.po.status, PurchaseOrder.NEEDS_TO_BE_PAID)
+        self.assertEqual(self.po.ln_invoices.get().pk, invoice_id)
+        process_initial_lni.apply_async.assert_called_once_with(priority=0, args=(invoice_id,), countdown=1)
+        self.assertEqual(self.get_log(), ['set to: NEEDS_LOCAL_CHECKS', 'set to: NEEDS_REMOTE_CHECKS',
+                                          'set to: NEEDS_INVOICE', f'added new poi: {invoice_id}',
+                                          'set to: NEEDS_TO_BE_PAID'])
+
+    def test_target_on_deny_list_is_rejected(self, process_initial_lni):
+        TorDenyList.objects.create(target='example.onion', status=TorDenyList.DENIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(process_initial_purchase_order(self.po.pk))
+
+        self.po.refresh_from_db()
+        self.assertEqual((self.po.status, self.po.message), (PurchaseOrder.REJECTED, 'Target is on Deny List'))
+        self.assertEqual(self.get_log(), ['set to: NEEDS_LOCAL_CHECKS', 'set to: REJECTED'])
+        self.assertFalse(self.po.ln_invoices.exists())
+
+    def test_remote_check_is_committed_before(self, process_initial_lni):
+        TorBridge.objects.update(target='example.onion:443')
+
+        def ensure_https(url):
+            self.assertEqual(PurchaseOrder.objects.get().status, PurchaseOrder.NEEDS_REMOTE_CHECKS)
+            return False
+
+        with mock.patch('charged.lnpurchase.tasks.ensure_https', side_effect=ensure_https) as check:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertIsNone(process_initial_purchase_order(self.po.pk))
+
+        check.assert_called_once_with('https://example.onion:443/')
+        self.po.refresh_from_db()
+        self.assertEqual((self.po.status, self.po.message), (PurchaseOrder.REJECTED, 'Target is not HTTPS'))
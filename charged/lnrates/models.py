@@ -114,6 +114,10 @@ class FiatRate(models.Model):
         ordering = ('-created_at',)
         verbose_name = _('fiat rate')
         verbose_name_plural = _('fiat rates')
+        indexes = [
+            models.Index(fields=['source', 'fiat_symbol', 'is_aggregate', 'created_at'],
+                         name='lnrates_fiatrate_lookup_idx'),
+        ]
 
     def __str__(self):
         return f'{self.__class__.__name__} {self.get_fiat_symbol_display()}/{self.get_coin_symbol_display()}'
@@ -0,0 +1,11 @@
+from charged.utils import buffered_change_log
+
+
+def buffered_change_log_middleware(get_response):
+    """write the change log entries of a request with a single insert"""
+
+    def middleware(request):
+        with buffered_change_log():
+            return get_response(request)
+
+    return middleware
@@ -1,7 +1,15 @@
+import threading
+from contextlib import contextmanager
+from functools import partial
+
 from django.conf import settings
 from django.contrib.admin.models import LogEntry, CHANGE
 from django.contrib.admin.options import get_content_type_for_model
 from django.core.mail import EmailMessage
+from django.db import transaction
+
+# change log entries of the current thread that are buffered by buffered_change_log (None: not buffering)
+_change_log = threading.local()
 
 
 class MailNotificationToOwnerError(Exception):
@@ -25,41 +33,83 @@ def create_email_message(subject: str, body: str, recipients: list,
     return msg
 
 
-def handle_obj_is_alive_change(obj, new_status):
-    LogEntry.objects.log_action(
-        user_id=1,
-        content_type_id=get_content_type_for_model(obj).pk,
-        object_id=obj.pk,
-        object_repr=str(obj),
-        action_flag=CHANGE,
-        change_message="Task: Check_alive -> set is_alive=%s" % new_status,
-    )
+def create_is_alive_change_email(obj, new_status):
+    return create_email_message(f'[IP2Tor] {obj.__class__.__name__} status change: {obj.name}',
+                                f'{obj} - is_alive now: {new_status}',
+                                [obj.owner.email],
+                                reference_tag=f'{obj.__class__.__name__.lower()}/{obj.id}')
 
-    if new_status:
-        obj.is_alive = True
-        obj.save()
-    else:
-        obj.is_alive = False
-        obj.save()
+
+def handle_obj_is_alive_change(obj, new_status):
+    """log and notify the owner - the caller has already stored the new status"""
+    add_change_log_entry(obj, "Task: Check_alive -> set is_alive=%s" % new_status)
 
     if obj.owner.email:
         try:
-            msg = create_email_message(f'[IP2Tor] {obj.__class__.__name__} status change: {obj.name}',
-                                       f'{obj} - is_alive now: {new_status}',
-                                       [obj.owner.email],
-                                       reference_tag=f'{obj.__class__.__name__.lower()}/{obj.id}')
+            msg = create_is_alive_change_email(obj, new_status)
             msg.send()
 
         except Exception:
             raise MailNotificationToOwnerError
 
 
-def add_change_log_entry(obj, message: str, user_id=1):
-    LogEntry.objects.log_action(
+def create_change_log_entry(obj, message: str, user_id=1, action_flag=CHANGE) -> LogEntry:
+    # get_content_type_for_model is served from the ContentType cache
+    return LogEntry(
         user_id=user_id,
         content_type_id=get_content_type_for_model(obj).pk,
-        object_id=obj.pk,
-        object_repr=str(obj),
-        action_flag=CHANGE,
+        object_id=str(obj.pk),
+        object_repr=str(obj)[:200],
+        action_flag=action_flag,
         change_message=message,
-    )
\ No newline at end of file
+    )
+
+
+@contextmanager
+def buffered_change_log():
+    """collect the change log entries that are added in this block (also usable as decorator, e.g. for
+    tasks) and write them with a single insert when the outermost block exits
+
+    Each entry is only collected once the transaction it was added in commits - entries added inside an
+    atomic block that is rolled back are discarded. The collected entries are also written if the block
+    raises (tasks raise after their changes have been committed, e.g. LnInvoiceHasExpiredError).
+    """
+    if getattr(_change_log, 'entries', None) is not None:
+        yield  # nested - the outermost block writes the entries
+        return
+
+    entries = _change_log.entries = []
+
+    def flush():
+        if entries:
+            LogEntry.objects.bulk_create(entries)
+
+    try:
+        yield
+    finally:
+        _change_log.entries = None
+        # still inside a transaction: the entries of that transaction are collected when it commits (before this)
+        transaction.on_commit(flush)
+
+
+def _add_entries(new_entries):
+    """buffer the entries (once the current transaction commits) or write them right away (not buffering)"""
+    entries = getattr(_change_log, 'entries', None)
+    if entries is not None:
+        transaction.on_commit(partial(entries.extend, new_entries))
+    elif len(new_entries) == 1:
+        new_entries[0].save()
+    else:
+        LogEntry.objects.bulk_create(new_entries)
+
+
+def add_change_log_entry(obj, message: str, user_id=1):
+    _add_entries([create_change_log_entry(obj, message, user_id=user_id)])
+
+
+def add_change_log_entries(objs, message: str, user_id=1, action_flag=CHANGE):
+    """same as add_change_log_entry but for many objects (uses a single insert)"""
+    new_entries = [create_change_log_entry(obj, message, user_id=user_id, action_flag=action_flag)
+                   for obj in objs]
+    if new_entries:
+        _add_entries(new_entries)
@@ -109,6 +109,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'charged.middleware.buffered_change_log_middleware',
 ]
 
 ROOT_URLCONF = 'django_ip2tor.urls'
@@ -277,6 +278,13 @@ CHARGED_TAX_CURRENCY_FIAT = env.str('CHARGED_TAX_CURRENCY_FIAT', default='EUR')
 CHARGED_INFO_CURRENCIES_FIAT = env.list('CHARGED_INFO_CURRENCIES_FIAT', default=['EUR', 'USD'])
 
 CHARGED_LNINVOICE_TIMEOUT = env.int('CHARGED_LNINVOICE_TIMEOUT', default=900)
+# set if the periodic task "charged.lninvoice.tasks.reconcile_invoices" is scheduled - invoices on nodes that
+# support listing (LND) are then not polled
+CHARGED_LNINVOICE_RECONCILIATION = env.bool('CHARGED_LNINVOICE_RECONCILIATION', default=False)
+# set if "manage.py listen_invoices" is running - invoices on streaming nodes are then not polled
+CHARGED_LNNODE_SETTLEMENT_LISTENER = env.bool('CHARGED_LNNODE_SETTLEMENT_LISTENER', default=False)
+# order of the nodes with the same priority for new invoices: "round_robin" or "weighted" (see BaseLnNode.weight)
+CHARGED_LNNODE_ROUTING = env.str('CHARGED_LNNODE_ROUTING', default='round_robin')
 
 SHOP_BRIDGE_DURATION_GRACE_TIME = env.int('SHOP_BRIDGE_DURATION_GRACE_TIME', default=600)
 
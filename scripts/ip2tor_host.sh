@@ -91,6 +91,13 @@ fi
 
 IP2TORC_CMD=/usr/local/bin/ip2torc.sh
 
+# loop: seconds between change feed requests, between check-ins (hello) and between full syncs
+# (the change feed is a single indexed query - polling it every 2 seconds keeps the activation latency of the
+# previous activate/suspend/hello polling while making 1 instead of 3 requests per interval)
+CHANGES_INTERVAL=${CHANGES_INTERVAL:-2}
+HELLO_INTERVAL=${HELLO_INTERVAL:-60}
+FULL_SYNC_INTERVAL=${FULL_SYNC_INTERVAL:-300}
+
 
 ###################
 # FUNCTIONS
@@ -152,7 +159,8 @@ if [ "$1" = "activate" ]; then
     if [ $? -eq 0 ]; then
       patch_url="${IP2TOR_SHOP_URL}/api/v1/tor_bridges/${b_id}/"
 
-      # now send PATCH to ${patch_url} that ${b_id} is done
+      # now send PATCH to ${patch_url} that ${b_id} is done (the shop also accepts a
+      # bridge.activated/bridge.suspended message on the host websocket - this agent uses HTTP)
       res=$(
         curl -X "PATCH" \
         ${CURL_TOR} \
@@ -217,12 +225,45 @@ elif [ "$1" = "list" ]; then
 ########
 elif [ "$1" = "loop" ]; then
   echo "Running on Shop: ${IP2TOR_SHOP_URL} (Host ID: ${IP2TOR_HOST_ID})"
+  cursor=""
+  last_sync=0
+  last_hello=0
   while :
   do
-    "${0}" activate
-    "${0}" suspend
-    "${0}" hello
-    sleep 2
+    # the change feed returns the bridges of this host that changed since the cursor (returns at once)
+    url="${IP2TOR_SHOP_URL}/api/v1/hosts/${IP2TOR_HOST_ID}/tor_bridge_changes/?cursor=${cursor}"
+    res=$(curl -q --max-time 30 ${CURL_TOR} -H "Authorization: Token ${IP2TOR_HOST_TOKEN}" "${url}" 2>/dev/null)
+    new_cursor=$(echo "${res}" | jq -r '.cursor // empty' 2>/dev/null)
+
+    if ! echo "${res}" | jq -e '.results' &>/dev/null; then
+      debug "Change feed not available (e.g. older shop or connection error) - polling"
+      "${0}" activate
+      "${0}" suspend
+      "${0}" hello
+      sleep 2
+      continue
+    fi
+
+    cursor="${new_cursor:-${cursor}}"
+    statuses=$(echo "${res}" | jq -r '.results[]?.status' 2>/dev/null)
+
+    # also do a full sync from time to time (e.g. in case a notification got lost)
+    if [ $((SECONDS - last_sync)) -ge ${FULL_SYNC_INTERVAL} ]; then
+      statuses="P S"
+      last_sync=${SECONDS}
+    fi
+
+    if [[ "${statuses}" == *"P"* ]]; then
+      "${0}" activate
+    fi
+    if [[ "${statuses}" == *"S"* ]]; then
+      "${0}" suspend
+    fi
+    if [ $((SECONDS - last_hello)) -ge ${HELLO_INTERVAL} ]; then
+      "${0}" hello
+      last_hello=${SECONDS}
+    fi
+    sleep ${CHANGES_INTERVAL}
   done
 
 #################
@@ -259,7 +300,8 @@ elif [ "$1" = "suspend" ]; then
     if [ $? -eq 0 ]; then
       patch_url="${IP2TOR_SHOP_URL}/api/v1/tor_bridges/${b_id}/"
 
-      # now send PATCH to ${patch_url} that ${b_id} is done
+      # now send PATCH to ${patch_url} that ${b_id} is done (the shop also accepts a
+      # bridge.activated/bridge.suspended message on the host websocket - this agent uses HTTP)
       res=$(
         curl -X "PATCH" \
         ${CURL_TOR} \
@@ -6,7 +6,7 @@ from django.http import JsonResponse
 from django.utils.translation import gettext_lazy as _
 
 from charged.lnnode.models import LndRestNode, CLightningNode, FakeNode
-from shop.forms import TorBridgeAdminForm, RSshTunnelAdminForm
+from shop.forms import TorBridgeAdminForm, RSshTunnelAdminForm, PortRangeInlineFormSet
 from shop.models import Host, PortRange, TorBridge, RSshTunnel, Bridge, TorDenyList, IpDenyList
 
 
@@ -26,6 +26,7 @@ class RSshTunnelInline(admin.TabularInline):
 
 class PortRangeInline(admin.TabularInline):
     model = PortRange
+    formset = PortRangeInlineFormSet
     extra = 0
 
 
@@ -71,7 +72,7 @@ class BridgeTunnelAdmin(admin.ModelAdmin):
     export_pos.short_description = _("Export POs for selected Bridges")
 
     def set_to_pending(self, request, queryset):
-        rows_updated = queryset.update(status=Bridge.NEEDS_ACTIVATE)
+        rows_updated = queryset.update_status(Bridge.NEEDS_ACTIVATE, "set to pending")
         if rows_updated == 1:
             message_bit = "1 entry was"
         else:
@@ -83,6 +84,10 @@ class BridgeTunnelAdmin(admin.ModelAdmin):
     def has_add_permission(self, request, obj=None):
         return False
 
+    def delete_queryset(self, request, queryset):
+        # the delete_selected action has already logged the deletions (as the admin user)
+        queryset.delete(change_log=False)
+
 
 class RSshTunnelAdmin(BridgeTunnelAdmin):
     form = RSshTunnelAdminForm
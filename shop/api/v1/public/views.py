@@ -22,7 +22,7 @@ class PublicHostViewSet(mixins.RetrieveModelMixin,
     API endpoint that allows **anybody** to `list` and `retrieve` hosts.
     `Create`, `edit` and `delete` is **not possible**.
     """
-    queryset = Host.active.all()
+    queryset = Host.active.select_related('site')
     serializer_class = serializers.PublicHostSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [DjangoFilterBackend]
@@ -83,7 +83,7 @@ class PublicPurchaseOrderItemDetailViewSet(mixins.RetrieveModelMixin,
     API endpoint that allows **anybody** to `retrieve` lnpurchase Purchase Order Items.
     `Create`, `edit`, `list` and `delete` is **not possible**.
     """
-    queryset = PurchaseOrderItemDetail.objects.all()
+    queryset = PurchaseOrderItemDetail.objects.prefetch_related('product__host__site')
     serializer_class = serializers.PublicShopPurchaseOrderItemDetailSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [DjangoFilterBackend]
@@ -95,7 +95,7 @@ class PublicPurchaseOrderViewSet(mixins.RetrieveModelMixin,
     API endpoint that allows **anybody** to `retrieve` lnpurchase Purchase Orders.
     `Create`, `edit`, `list` and `delete` is **not possible**.
     """
-    queryset = PurchaseOrder.objects.all()
+    queryset = PurchaseOrder.objects.prefetch_related('item_details__product__host__site', 'ln_invoices')
     serializer_class = serializers.PublicShopPurchaseOrderSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [DjangoFilterBackend]
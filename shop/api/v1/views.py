@@ -1,10 +1,15 @@
+import uuid
+from datetime import timedelta
+
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.utils import timezone
 from django.utils.encoding import smart_text
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, viewsets
 from rest_framework import renderers
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 
 from shop.models import TorBridge, Host
@@ -20,6 +25,19 @@ class PlainTextRenderer(renderers.BaseRenderer):
         return smart_text(data, encoding=self.charset)
 
 
+# change feed cursors are "<modification date as microseconds since the epoch>_<id>" of the last change
+CURSOR_EPOCH = timezone.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_cursor(cursor):
+    micros, _, pk = cursor.partition('_')
+    return CURSOR_EPOCH + timedelta(microseconds=int(micros)), uuid.UUID(pk) if pk else uuid.UUID(int=0)
+
+
+def make_cursor(modified_at, pk):
+    return f'{(modified_at - CURSOR_EPOCH) // timedelta(microseconds=1)}_{pk}'
+
+
 class TorBridgeViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows **admins** and **authenticated users** to `create`, `retrieve`,
@@ -106,6 +124,11 @@ class HostViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.HostSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    CHANGES_PAGE_SIZE = 100
+    # modification dates are set before the change commits - the cursor stays this far behind so that
+    # changes of transactions that commit late are not skipped (recent changes may be returned again)
+    CHANGES_SETTLE_TIME = timedelta(seconds=10)
+
     def get_queryset(self):
         """
         This view returns a list of all the tor bridges for the currently authenticated user.
@@ -133,6 +156,39 @@ class HostViewSet(viewsets.ModelViewSet):
             'message': host.ci_message
         })
 
+    @action(detail=True, methods=['get'])
+    def tor_bridge_changes(self, request, pk=None):
+        """
+        Change feed of the tor bridges of a host. Returns the tor bridges that changed after `cursor`
+        (all tor bridges if no cursor is given) and the `cursor` to use for the next request. Returns
+        at once - hosts that want to be notified immediately use the websocket (HostConsumer).
+        """
+        host = self.get_object()
+
+        try:
+            cursor = request.query_params.get('cursor') or None
+            since = parse_cursor(cursor) if cursor else (None, None)
+        except (ValueError, OverflowError):
+            raise ParseError('cursor must be a cursor returned by this endpoint.')
+
+        changes = list(TorBridge.objects
+                       .filter(host=host)
+                       .select_related('host__site')
+                       .changed_since(*since)[:self.CHANGES_PAGE_SIZE])
+
+        if changes:
+            # the last change - but not past the settle time (see CHANGES_SETTLE_TIME) and never backwards
+            settled = (timezone.now() - self.CHANGES_SETTLE_TIME, uuid.UUID(int=0))
+            position = min((changes[-1].modified_at, changes[-1].pk), settled)
+            if since[0] is None or position > since:
+                cursor = make_cursor(*position)
+
+        serializer = serializers.TorBridgeSerializer(changes, many=True, context={'request': request})
+        return Response({
+            'cursor': cursor or '',
+            'results': serializer.data
+        })
+
 
 class SiteViewSet(viewsets.ModelViewSet):
     """
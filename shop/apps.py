@@ -13,3 +13,7 @@ class ShopConfig(AppConfig):
 
         # make sure to create default 'operators' group and assign permissions
         post_migrate.connect(signals.create_default_operator_group, sender=self)
+
+        # convert port usage data of existing port ranges to the bitmap format
+        post_migrate.connect(signals.convert_legacy_port_usage, sender=self)
+        post_migrate.connect(signals.update_hosts_ports_available, sender=self)
@@ -6,6 +6,11 @@ from json import JSONDecodeError
 from asgiref.sync import async_to_sync
 from channels.consumer import SyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer, AsyncConsumer, JsonWebsocketConsumer
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from charged.utils import add_change_log_entry
+from shop.models import TorBridge
 
 log = logging.getLogger(__name__)
 
@@ -97,12 +102,21 @@ class HostConsumer(JsonWebsocketConsumer):
 
         self.send(text_data="[Welcome: %s]" % self.user)
 
+        # catch up on the commands that were sent while the host was not connected
+        for bridge in TorBridge.objects.filter(host__token_user=self.user,
+                                               status__in=TorBridge.HOST_COMMANDS).order_by('modified_at'):
+            self.send_json(bridge.get_host_command())
+
     def receive_json(self, content, **kwargs):
         if 'type' not in content.keys():
             print('Error: no type set')
             print(content)
             return
 
+        if content['type'] in TorBridge.HOST_ACKNOWLEDGEMENTS:
+            self.acknowledge_bridge(content)
+            return
+
         if content['type'] not in ['channel_message',
                                    'channel.message',
                                    'host.checkport',
@@ -122,6 +136,36 @@ class HostConsumer(JsonWebsocketConsumer):
     def disconnect(self, message):
         pass
 
+    def acknowledge_bridge(self, content):
+        """host reports that it activated/suspended a bridge - update the status (instead of a PATCH)"""
+        expected_status, status = TorBridge.HOST_ACKNOWLEDGEMENTS[content['type']]
+
+        with transaction.atomic():
+            try:
+                bridge = TorBridge.objects.select_for_update().get(pk=content.get('id'),
+                                                                   host__token_user=self.user)
+            except (TorBridge.DoesNotExist, ValidationError):
+                self.send_json({'type': 'error',
+                                'message': f'unknown bridge: {content.get("id")}'})
+                return
+
+            # the status may have been changed in the meantime (or this is a duplicate)
+            if bridge.status == expected_status:
+                bridge.status = status
+                bridge.save()
+                add_change_log_entry(bridge, f"acknowledged by host: {content['type']}")
+
+        self.send_json({'type': f'{content["type"]}.ack',
+                        'id': str(bridge.id),
+                        'status': bridge.status})
+
+    # Receive and process the commands for the host (see Bridge.send_host_commands)
+    def bridge_activate(self, event):
+        self.send_json(event)
+
+    def bridge_suspend(self, event):
+        self.send_json(event)
+
     # Receive and process a 'channel_message'
     def channel_message(self, event):
         message = event['message']
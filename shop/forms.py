@@ -1,4 +1,5 @@
 from django import forms
+from django.utils.translation import gettext_lazy as _
 
 from shop.models import TorBridge, RSshTunnel
 
@@ -31,3 +32,21 @@ class RSshTunnelAdminForm(forms.ModelForm):
     class Meta:
         model = RSshTunnel
         fields = '__all__'
+
+
+class PortRangeInlineFormSet(forms.BaseInlineFormSet):
+    def clean(self):
+        """port ranges that are added or changed together must not overlap each other either
+        (PortRange.clean only checks against the ranges that are already stored)"""
+        super().clean()
+
+        ranges = sorted((form.cleaned_data['start'], form.cleaned_data['end']) for form in self.forms
+                        if form.cleaned_data.get('start') is not None and form.cleaned_data.get('end') is not None
+                        and not self._should_delete_form(form))
+
+        for previous, current in zip(ranges, ranges[1:]):
+            if current[0] <= previous[1]:
+                raise forms.ValidationError(_('Port Range %(start)s-%(end)s overlaps with Port Range '
+                                              '%(other_start)s-%(other_end)s.'),
+                                            params={'start': current[0], 'end': current[1],
+                                                    'other_start': previous[0], 'other_end': previous[1]})
@@ -0,0 +1,80 @@
+"""Heartbeats (check-ins) of the hosts in redis
+
+Every check-in of a host is recorded in redis. The check-in columns of the Host (ci_date, ci_status and
+ci_message) are only written on state transitions (see Host.check_in) and periodically by the
+persist_host_heartbeats task. The functions raise HeartbeatUnavailable if redis can not be used (e.g. a
+different cache backend is configured) - callers fall back to the database.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+# sorted set: host id -> timestamp of the last check-in with status HELLO
+HOSTS_KEY = 'ip2tor.heartbeat.hosts'
+# hash with the last check-in of a host (date, status, message) - expires when the host is not alive anymore
+HOST_KEY = 'ip2tor.heartbeat.host.{}'
+
+
+class HeartbeatUnavailable(Exception):
+    pass
+
+
+def _get_connection():
+    try:
+        return get_redis_connection("default")
+    except NotImplementedError as err:
+        raise HeartbeatUnavailable(err)
+
+
+def record(host_id, status, message, date, timeout, hello):
+    """store a check-in (the host counts as alive for timeout if status is hello)"""
+    key = HOST_KEY.format(host_id)
+    try:
+        pipe = _get_connection().pipeline()
+        pipe.hset(key, mapping={'date': date.timestamp(), 'status': status, 'message': message})
+        pipe.expire(key, timeout)
+        if status == hello:
+            pipe.zadd(HOSTS_KEY, {str(host_id): date.timestamp()})
+        else:
+            pipe.zrem(HOSTS_KEY, str(host_id))
+        pipe.execute()
+    except RedisError as err:
+        raise HeartbeatUnavailable(err)
+
+
+def get_alive_host_ids(timeout, now=None):
+    """ids (as strings) of the hosts with a check-in with status hello within timeout"""
+    if now is None:
+        now = timezone.now()
+    min_score = (now - timeout).timestamp()
+    try:
+        con = _get_connection()
+        pipe = con.pipeline()
+        pipe.zremrangebyscore(HOSTS_KEY, '-inf', min_score)  # expired heartbeats
+        pipe.zrangebyscore(HOSTS_KEY, f'({min_score}', '+inf')
+        _, host_ids = pipe.execute()
+    except RedisError as err:
+        raise HeartbeatUnavailable(err)
+    return {x.decode() for x in host_ids}
+
+
+def get_check_ins(host_ids):
+    """the last (not expired) check-in of each host: {host id: (date, status, message)}"""
+    host_ids = [str(x) for x in host_ids]
+    try:
+        pipe = _get_connection().pipeline()
+        for host_id in host_ids:
+            pipe.hgetall(HOST_KEY.format(host_id))
+        results = pipe.execute()
+    except RedisError as err:
+        raise HeartbeatUnavailable(err)
+
+    check_ins = {}
+    for host_id, result in zip(host_ids, results):
+        if not result:
+            continue
+        date = datetime.fromtimestamp(float(result[b'date']), tz=dt_timezone.utc)
+        check_ins[host_id] = (date, int(result[b'status']), result[b'message'].decode())
+    return check_ins
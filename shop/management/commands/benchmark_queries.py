@@ -0,0 +1,153 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from djmoney.money import Money
+
+from charged.lninvoice.models import Invoice
+from charged.lnpurchase.models import PurchaseOrder
+from charged.lnrates.models import FiatRate
+from shop.models import Host, TorBridge, RSshTunnel
+
+
+class Rollback(Exception):
+    """Used to roll back the seeded data and the index changes"""
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the hot queries (query plans and latency) with and without indexes on a seeded dataset. ' \
+           'Everything runs in a transaction that is rolled back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hosts', type=int, default=50, help='Number of hosts to seed')
+        parser.add_argument('--bridges', type=int, default=50000, help='Number of tor bridges to seed')
+        parser.add_argument('--orders', type=int, default=20000, help='Number of POs and invoices to seed')
+        parser.add_argument('--rates', type=int, default=20000, help='Number of fiat rates to seed')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query (median is reported)')
+        parser.add_argument('--no-plans', action='store_true', help='Do not print query plans')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        self.show_plans = not options['no_plans']
+
+        try:
+            with transaction.atomic():
+                host = self.seed(options['hosts'], options['bridges'], options['orders'], options['rates'])
+                queries = self.get_queries(host)
+
+                results = self.run('with indexes', queries)
+                self.drop_indexes()
+                results_without = self.run('without indexes', queries)
+
+                self.stdout.write(self.style.MIGRATE_HEADING('Summary (median ms)'))
+                for label in queries:
+                    self.stdout.write(f'{label:<40} {results_without[label]:>9.3f} -> {results[label]:>9.3f}')
+
+                raise Rollback
+
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Done (seeded data and index changes were rolled back).'))
+
+    def seed(self, hosts, bridges, orders, rates):
+        self.stdout.write(f'Seeding {hosts} hosts, {bridges} tor bridges, {orders} POs/invoices, {rates} rates...')
+        now = timezone.now()
+
+        owner = get_user_model().objects.create(username=f'benchmark-{now.timestamp()}', is_staff=True)
+        host_objs = Host.objects.bulk_create([
+            Host(ip=f'198.51.{i // 256}.{i % 256}', name=f'bench{i}', owner=owner) for i in range(hosts)
+        ])
+
+        statuses = [TorBridge.ACTIVE] * 30 + [TorBridge.SUSPENDED] * 40 + [TorBridge.ARCHIVED] * 20 \
+            + [TorBridge.INITIAL] * 5 + [TorBridge.NEEDS_DELETE] * 4 + [TorBridge.NEEDS_ACTIVATE]
+        TorBridge.objects.bulk_create([
+            TorBridge(host=random.choice(host_objs),
+                      status=random.choice(statuses),
+                      port=random.randint(10000, 65535),
+                      target='benchmark.onion:80',
+                      suspend_after=now + timedelta(hours=random.randint(-24 * 90, 24 * 30)))
+            for _ in range(bridges)
+        ], batch_size=1000)
+
+        # modified_at is auto_now (also on bulk_create) - age a part of the bridges
+        old = list(TorBridge.objects.values_list('pk', flat=True).order_by('?')[:bridges // 10])
+        for i in range(0, len(old), 500):
+            TorBridge.objects.filter(pk__in=old[i:i + 500]).update(modified_at=now - timedelta(days=60))
+
+        po_statuses = [PurchaseOrder.FULFILLED] * 50 + [PurchaseOrder.PAID] * 20 + [PurchaseOrder.REJECTED] * 20 \
+            + [PurchaseOrder.NEEDS_TO_BE_PAID] * 9 + [PurchaseOrder.INITIAL]
+        PurchaseOrder.objects.bulk_create([
+            PurchaseOrder(status=random.choice(po_statuses)) for _ in range(orders)
+        ], batch_size=1000)
+
+        inv_statuses = [Invoice.PAID] * 60 + [Invoice.EXPIRED] * 35 + [Invoice.UNPAID] * 5
+        Invoice.objects.bulk_create([
+            Invoice(label='benchmark', msatoshi=25000, status=random.choice(inv_statuses)) for _ in range(orders)
+        ], batch_size=1000)
+
+        FiatRate.objects.bulk_create([
+            FiatRate(coin_symbol=FiatRate.BTC,
+                     fiat_symbol=random.choice([FiatRate.EUR, FiatRate.USD]),
+                     rate=Money(10000, 'EUR'),
+                     source=FiatRate.COIN_GECKO,
+                     is_aggregate=random.random() < 0.9)
+            for _ in range(rates)
+        ], batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')  # update planner statistics
+
+        return host_objs[0]
+
+    @staticmethod
+    def get_queries(host):
+        now = timezone.now()
+        return {
+            'host poll (host, status=P)':
+                TorBridge.objects.filter(host=host, status=TorBridge.NEEDS_ACTIVATE),
+            'sweep: expired (status=A, suspend_after)':
+                TorBridge.objects.filter(status=TorBridge.ACTIVE, suspend_after__lt=now),
+            'sweep: suspended (status=H, modified_at)':
+                TorBridge.objects.filter(status=TorBridge.SUSPENDED, modified_at__lt=now - timedelta(days=45)),
+            'sweep: initial (status=I, modified_at)':
+                TorBridge.objects.filter(status=TorBridge.INITIAL, modified_at__lt=now - timedelta(days=3)),
+            'initial purchase orders (status)':
+                PurchaseOrder.objects.filter(status=PurchaseOrder.INITIAL),
+            'unpaid invoices (status)':
+                Invoice.objects.filter(status=Invoice.UNPAID),
+            'latest rate (source, fiat, is_aggregate)':
+                FiatRate.objects.filter(source=FiatRate.COIN_GECKO, fiat_symbol=FiatRate.EUR,
+                                        is_aggregate=False).order_by('-created_at')[:1],
+        }
+
+    def run(self, title, queries):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Queries {title}'))
+
+        results = dict()
+        for label, qs in queries.items():
+            timings = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                list(qs.all())  # all() clones the queryset (no result cache)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            results[label] = statistics.median(timings)
+            self.stdout.write(f'{label}: {results[label]:.3f} ms')
+            if self.show_plans:
+                self.stdout.write(f'    {qs.explain()}'.replace('\n', '\n    '))
+
+        return results
+
+    @staticmethod
+    def drop_indexes():
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model in (TorBridge, RSshTunnel, PurchaseOrder, Invoice, FiatRate):
+                for index in model._meta.indexes:
+                    cursor.execute(str(index.remove_sql(model, editor)))
+            cursor.execute('ANALYZE')
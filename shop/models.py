@@ -1,28 +1,48 @@
 import ast
+import asyncio
+import logging
 import uuid
+from collections import defaultdict
 from datetime import timedelta
-from random import randint
+from random import sample
 
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.contrib.admin.models import DELETION
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Count
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_redis import get_redis_connection
+from redis.exceptions import RedisError
 from rest_framework.authtoken.models import Token
 
 from charged.lnpurchase.models import Product, PurchaseOrder, PurchaseOrderItemDetail
-from charged.utils import add_change_log_entry
+from charged.utils import add_change_log_entry, add_change_log_entries
+from shop import heartbeat
 from shop.exceptions import PortNotInUseError, PortInUseError
+from shop.ports import PortBitmap, PortRangeIndex
 from shop.validators import validate_host_name_blacklist
 from shop.validators import validate_host_name_no_underscore
 from shop.validators import validate_target_has_port
 from shop.validators import validate_target_is_onion
 
+try:
+    from aioredis.errors import RedisError as AioRedisError  # channels_redis < 4 (newer versions use redis-py)
+except ImportError:
+    AioRedisError = RedisError
+
+log = logging.getLogger(__name__)
+
+# errors of the channel layer (e.g. redis is not reachable) when pushing commands to the hosts
+CHANNEL_LAYER_ERRORS = (ChannelFull, OSError, asyncio.TimeoutError, RedisError, AioRedisError)
+
 
 class DenyList(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -102,6 +122,10 @@ class ActiveHostManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(is_enabled=True).filter(is_alive=True)
 
+    def checked_in(self, now=None):
+        """enabled hosts that are alive right now (by their heartbeat - not the is_alive flag)"""
+        return super().get_queryset().filter(is_enabled=True).filter(Host.get_alive_q(now))
+
 
 class Host(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -222,6 +246,28 @@ class Host(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(2)]  # also set/update this on Serializers
     )
 
+    # Available Ports (maintained by PortRange - see update_ports_available)
+    tor_bridge_ports_available = models.PositiveIntegerField(
+        verbose_name=_('available Tor Bridge ports'),
+        help_text=_('Number of free ports in all Tor Bridge port ranges of this host.'),
+        editable=False,
+        default=0
+    )
+
+    rssh_tunnels_ports_available = models.PositiveIntegerField(
+        verbose_name=_('available Reverse SSH Tunnel ports'),
+        help_text=_('Number of free ports in all Reverse SSH Tunnel port ranges of this host.'),
+        editable=False,
+        default=0
+    )
+
+    PORTS_AVAILABLE_FIELDS = ('tor_bridge_ports_available', 'rssh_tunnels_ports_available')
+
+    # hosts that did not check in (with status HELLO) for this long are not alive
+    CHECK_IN_TIMEOUT = timedelta(minutes=5)
+    # identical check-ins within this interval are not written (must be well below CHECK_IN_TIMEOUT)
+    CHECK_IN_COALESCE_INTERVAL = timedelta(minutes=1)
+
     objects = models.Manager()  # default
     active = ActiveHostManager()
 
@@ -230,17 +276,46 @@ class Host(models.Model):
         verbose_name = _('Host')
         verbose_name_plural = _('hosts')
         unique_together = ['site', 'name']
+        indexes = [
+            # host_alive_check
+            models.Index(fields=['ci_status', 'ci_date'], name='shop_host_ci_idx'),
+        ]
 
     def __str__(self):
         return 'Host:{} ({} - Owner:{})'.format(self.ip, self.name, self.owner)
 
     def check_alive_status(self):
-        if self.ci_date is None:
+        ci_date, ci_status = self.ci_date, self.ci_status
+        try:
+            check_in = heartbeat.get_check_ins([self.pk]).get(str(self.pk))
+            if check_in:
+                ci_date, ci_status, _ = check_in
+        except heartbeat.HeartbeatUnavailable:
+            pass
+
+        if ci_date is None:
             return False
-        has_fresh_check_in = self.ci_date > timezone.now() - timedelta(minutes=5)
-        return self.ci_status == self.HELLO and has_fresh_check_in
+        has_fresh_check_in = ci_date > timezone.now() - self.CHECK_IN_TIMEOUT
+        return ci_status == self.HELLO and has_fresh_check_in
+
+    @classmethod
+    def get_alive_q(cls, now=None):
+        """same as check_alive_status but as a filter (e.g. Host.objects.filter(Host.get_alive_q()))"""
+        if now is None:
+            now = timezone.now()
+        try:
+            return models.Q(pk__in=heartbeat.get_alive_host_ids(cls.CHECK_IN_TIMEOUT, now))
+        except heartbeat.HeartbeatUnavailable:
+            return models.Q(ci_status=cls.HELLO, ci_date__gt=now - cls.CHECK_IN_TIMEOUT)
 
     def check_in(self, status=None, message=None, date=None):
+        """record a check-in of the host - returns False if the database was not written
+
+        The check-in is stored as heartbeat in redis. The check-in columns are only written if status or
+        message changed (the heartbeats are persisted by the persist_host_heartbeats task). Without redis
+        only the check-in columns are written (no full save()) and a check-in with the same status and
+        message as the stored one is skipped if the stored one is less than CHECK_IN_COALESCE_INTERVAL old.
+        """
         if status is None:
             status = Host.HELLO
         if message is None:
@@ -248,45 +323,64 @@ class Host(models.Model):
         if date is None:
             date = timezone.now().replace(microsecond=0)
 
+        try:
+            heartbeat.record(self.pk, status, message, date, timeout=self.CHECK_IN_TIMEOUT, hello=Host.HELLO)
+            if self.ci_date is not None and (self.ci_status, self.ci_message) == (status, message):
+                self.ci_date = date
+                return False  # no transition
+            unchanged = models.Q(ci_status=status, ci_message=message, ci_date__isnull=False)
+        except heartbeat.HeartbeatUnavailable:
+            unchanged = models.Q(ci_status=status, ci_message=message,
+                                 ci_date__gt=date - self.CHECK_IN_COALESCE_INTERVAL)
+
+        updated = Host.objects \
+            .filter(pk=self.pk) \
+            .exclude(unchanged) \
+            .update(ci_date=date, ci_status=status, ci_message=message)
+
+        if not updated:
+            return False
+
         self.ci_date = date
         self.ci_status = status
         self.ci_message = message
-        self.save()
+        return True
 
     def get_random_port(self):
-        port_range = self.port_ranges.all()
-        # use only ranges that have less than 85% usage
-        port_range = [x for x in port_range if x.ports_used_percent < 0.85]
-
-        if not port_range:
-            return
-
-        rand_port_range = port_range[randint(0, len(port_range) - 1)]
-
-        rand_port = None
-        for _ in range(0, rand_port_range.ports_total):
-            rand_port = randint(rand_port_range.start, rand_port_range.end)
-            if not rand_port_range.check_port_usage(rand_port):
-                rand_port_range.add_port_usage(rand_port)
-                break
-
-        return rand_port
-
-    @property
-    def tor_bridge_ports_available(self):
-        total = 0
-        for _range in self.port_ranges.filter(type=PortRange.TOR_BRIDGE):
-            total += _range.ports_available
-        return total
-
-    @property
-    def rssh_tunnels_ports_available(self):
-        total = 0
-        for _range in self.port_ranges.filter(type=PortRange.RSSH_TUNNEL):
-            total += _range.ports_available
-        return total
+        with transaction.atomic():
+            # lock the port ranges of this host until the port is reserved so that bridges that
+            # are created in parallel (e.g. by several workers) can not claim the same port
+            port_ranges = [x for x in self.port_ranges.select_for_update() if x.ports_available]
+
+            # prefer ranges that have less than 85% usage - only use the others once these are full
+            preferred = [x for x in port_ranges if x.ports_used_percent < 0.85]
+            others = [x for x in port_ranges if x.ports_used_percent >= 0.85]
+
+            for port_range in sample(preferred, len(preferred)) + sample(others, len(others)):
+                rand_port = port_range.bitmap.random_free()
+                if rand_port is not None:
+                    port_range.add_port_usage(rand_port)
+                    return rand_port
+
+        return None  # all ports of this host are in use
+
+    def update_ports_available(self):
+        """recalculate the available port counters from the port ranges of this host"""
+        available = dict(self.port_ranges.order_by()
+                         .values_list('type')
+                         .annotate(available=Sum(F('end') - F('start') + 1 - F('used_count'))))
+
+        self.tor_bridge_ports_available = available.get(PortRange.TOR_BRIDGE) or 0
+        self.rssh_tunnels_ports_available = available.get(PortRange.RSSH_TUNNEL) or 0
+        Host.objects.filter(pk=self.pk).update(tor_bridge_ports_available=self.tor_bridge_ports_available,
+                                               rssh_tunnels_ports_available=self.rssh_tunnels_ports_available)
 
     def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('update_fields'):
+            # the port counters are updated by the port ranges - don't overwrite them with stale values
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in self.PORTS_AVAILABLE_FIELDS]
+
         super().save(*args, **kwargs)
 
         if not self.token_user:
@@ -329,36 +423,72 @@ class PortRange(models.Model):
                                       help_text=_('End Port - Must be in range 10000 - 65535.'),
                                       validators=[MinValueValidator(10000), MaxValueValidator(65535)])
 
+    # legacy - replaced by "usage" and converted by signals.convert_legacy_port_usage (post_migrate). Can be
+    # removed (together with the conversion) once every installation has migrated with a release that has "usage".
     _used = models.TextField(editable=False,
                              default='{}',
-                             verbose_name=_('Used Ports'),
-                             help_text=_('Which Ports are currently in use.'))
+                             verbose_name=_('Used Ports (legacy)'),
+                             help_text=_('Which Ports were in use (legacy format - see Port Usage).'))
+
+    usage = models.BinaryField(editable=False,
+                               default=b'',
+                               verbose_name=_('Port Usage'),
+                               help_text=_('Bitmap of the Ports that are currently in use.'))
+
+    used_count = models.PositiveIntegerField(editable=False,
+                                             default=0,
+                                             verbose_name=_('Used Ports'),
+                                             help_text=_('Number of Ports that are currently in use.'))
 
     host = models.ForeignKey('Host', on_delete=models.CASCADE, related_name='port_ranges')
 
+    HOST_PORTS_AVAILABLE_FIELD = {
+        TOR_BRIDGE: 'tor_bridge_ports_available',
+        RSSH_TUNNEL: 'rssh_tunnels_ports_available',
+    }
+
     class Meta:
         ordering = ['start']
         verbose_name = _('Port Range')
         verbose_name_plural = _('Port Ranges')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bitmap = None
+        self._bitmap_source = None
+
     def __str__(self):
         return '{}: {}-{} ({}/{})'.format(self._meta.verbose_name,
                                           self.start, self.end,
                                           self.ports_used, self.ports_total)
 
+    @property
+    def bitmap(self):
+        # only rebuild if usage was (re-)loaded from the database or the range was changed
+        bitmap = self._bitmap
+        if bitmap is None or self._bitmap_source is not self.usage \
+                or bitmap.start != self.start or bitmap.end != self.end:
+            bitmap = PortBitmap(self.start, self.end, self.usage)
+            self._bitmap = bitmap
+            self._bitmap_source = self.usage
+        return bitmap
+
+    @bitmap.setter
+    def bitmap(self, value):
+        self.usage = bytes(value)
+        self.used_count = len(value)
+        self._bitmap = value
+        self._bitmap_source = self.usage
+
     @property
     def used(self):
-        if self._used:
-            if self._used == 'set()':  # ToDo(frennkie) this is a bug... _used should never contain "set()"
-                return set()
-            return set(ast.literal_eval(self._used))
-        return set()
+        return set(self.bitmap)
 
     @used.setter
     def used(self, value):
         if not isinstance(value, set):
             raise ValueError('Must be of type set.')
-        self._used = value.__str__()
+        self.bitmap = PortBitmap.from_ports(self.start, self.end, value)
 
     @property
     def ports_total(self):
@@ -366,11 +496,11 @@ class PortRange(models.Model):
 
     @property
     def ports_used(self):
-        return len(self.used)
+        return self.used_count
 
     @property
     def ports_used_percent(self):
-        return len(self.used) / self.ports_total * 1.0
+        return self.used_count / self.ports_total * 1.0
 
     @property
     def ports_available(self):
@@ -381,20 +511,23 @@ class PortRange(models.Model):
             raise ValueError('Must be of type int.')
         if not 1025 <= value <= 65535:
             raise ValueError('Must be in range 1025 - 65535.')
-        if value in self.used:
+        if value in self.bitmap:
             raise PortInUseError
 
-        new_set = self.used.copy()
-        new_set.add(value)
-        self.used = new_set
-        self.save()
+        bitmap = self.bitmap
+        bitmap.add(value)
+        self.usage = bytes(bitmap)
+        self._bitmap_source = self.usage
+        self.used_count += 1
+        self.save(update_fields=['usage', 'used_count', 'modified_at'])
+        self.update_host_ports_available(-1)
 
     def check_port_usage(self, value):
         if not isinstance(value, int):
             raise ValueError('Must be of type int.')
         if not 1025 <= value <= 65535:
             raise ValueError('Must be in range 1025 - 65535.')
-        if value in self.used:
+        if value in self.bitmap:
             return True
         return False
 
@@ -403,46 +536,158 @@ class PortRange(models.Model):
             raise ValueError('Must be of type int.')
         if not 1025 <= value <= 65535:
             raise ValueError('Must be in range 1025 - 65535.')
-        if value not in self.used:
+        if value not in self.bitmap:
             raise PortNotInUseError
 
-        new_set = self.used.copy()
-        new_set.remove(value)
-        if len(new_set):
-            self.used = new_set
-        else:
-            self._used = new_set.__str__()
+        bitmap = self.bitmap
+        bitmap.discard(value)
+        self.usage = bytes(bitmap)
+        self._bitmap_source = self.usage
+        self.used_count -= 1
+        self.save(update_fields=['usage', 'used_count', 'modified_at'])
+        self.update_host_ports_available(1)
+
+    def remove_ports_usage(self, ports):
+        """release several ports at once (with a single update) - returns the number of released ports"""
+        bitmap = self.bitmap
+        released = 0
+        for port in ports:
+            if port in bitmap:
+                bitmap.discard(port)
+                released += 1
+
+        if released:
+            self.bitmap = bitmap
+            self.save(update_fields=['usage', 'used_count', 'modified_at'])
+            self.update_host_ports_available(released)
+        return released
+
+    def update_host_ports_available(self, delta):
+        field = self.HOST_PORTS_AVAILABLE_FIELD.get(self.type)
+        if field and delta:
+            Host.objects.filter(pk=self.host_id).update(**{field: F(field) + delta})
+
+    def convert_legacy_usage(self):
+        """merge ports from the legacy "_used" text (a python set literal) into the bitmap"""
+        if self._used in ('', '{}', 'set()'):
+            return False
+
+        bitmap = self.bitmap
+        for port in ast.literal_eval(self._used):
+            if port in range(self.start, self.end + 1):
+                bitmap.add(port)
 
-        self.save()
+        self.bitmap = bitmap
+        self._used = '{}'
+        self.save(update_fields=['_used', 'usage', 'used_count', 'modified_at'])
+        return True
 
     def clean(self):
         if self.start >= self.end:
             raise ValidationError(_('Start Port must be lower than End Port.'))
 
-        # ToDo(frennkie) how to make sure port ranges don't overlap!
+        # port ranges of a host must not overlap (otherwise a port could be handed out twice)
+        overlap = (PortRange.objects.filter(host_id=self.host_id, start__lte=self.end, end__gte=self.start)
+                   .exclude(pk=self.pk).values_list('start', 'end').first())
+        if overlap:
+            raise ValidationError(_('Port Range overlaps with existing Port Range: %(start)s-%(end)s.'),
+                                  params={'start': overlap[0], 'end': overlap[1]})
+
+        # usage is stored relative to the start port - a range that is in use can only be extended
+        if self.used_count:
+            stored = PortRange.objects.filter(pk=self.pk).values_list('start', 'end').first()
+            if stored and stored[0] != self.start:
+                raise ValidationError(_('Start Port can not be changed while Ports are in use.'))
+            if stored and max(PortBitmap(*stored, self.usage), default=0) > self.end:
+                raise ValidationError(_('End Port can not be lower than a Port that is in use.'))
+
+
+class BridgeQuerySet(models.QuerySet):
+    def delete(self, change_log=True):
+        """delete the bridges and release their ports (one update per port range) - change_log=False if the
+        deletions have already been logged (e.g. by the delete_selected admin action)"""
+        with transaction.atomic():
+            bridges = list(self.select_related('host__owner'))
+
+            ports = defaultdict(set)
+            for bridge in bridges:
+                if isinstance(bridge.port, int):
+                    ports[bridge.host_id].add(bridge.port)
+
+            for host_id in sorted(ports, key=str):
+                port_ranges = {x.pk: x for x in PortRange.objects.select_for_update().filter(host_id=host_id)}
+                index = PortRangeIndex((x.start, x.end, x.pk) for x in port_ranges.values())
+                range_ports = defaultdict(list)
+                for port in ports[host_id]:
+                    port_range_id = index.find(port)
+                    if port_range_id:
+                        range_ports[port_range_id].append(port)
+
+                for port_range_id, range_port_list in range_ports.items():
+                    port_ranges[port_range_id].remove_ports_usage(range_port_list)
+
+            if change_log:
+                add_change_log_entries(bridges, "deleted", action_flag=DELETION)
+
+            # only delete what was processed above (self might match additional rows by now)
+            return super(BridgeQuerySet, self.model.objects.filter(pk__in=[x.pk for x in bridges])).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update_status(self, status, message):
+        """set status on the bridges with a single update and add change log entries with a single insert"""
+        with transaction.atomic():
+            bridges = list(self.select_related('host__owner', 'host__token_user'))
+            if not bridges:
+                return 0
+
+            # update() doesn't touch auto_now fields
+            counter = self.filter(pk__in=[x.pk for x in bridges]).update(status=status, modified_at=timezone.now())
 
+            for bridge in bridges:
+                bridge.status = status
+            add_change_log_entries(bridges, message)
 
-class InitialTorBridgeManager(models.Manager):
+            if status in self.model.HOST_COMMANDS:
+                transaction.on_commit(lambda: self.model.send_host_commands(bridges))
+
+        return counter
+
+    update_status.alters_data = True
+
+    def changed_since(self, modified_at=None, pk=None):
+        """bridges that were modified after (modified_at, pk) (all if modified_at is None) - oldest change first"""
+        qs = self.order_by('modified_at', 'pk')
+        if modified_at is not None:
+            qs = qs.filter(Q(modified_at__gt=modified_at) | Q(modified_at=modified_at, pk__gt=pk))
+        return qs
+
+
+BridgeManager = models.Manager.from_queryset(BridgeQuerySet)
+
+
+class InitialTorBridgeManager(BridgeManager):
     def get_queryset(self):
         return super().get_queryset().filter(review_status=TorBridge.INITIAL)
 
 
-class PendingTorBridgeManager(models.Manager):
+class PendingTorBridgeManager(BridgeManager):
     def get_queryset(self):
         return super().get_queryset().filter(review_status=TorBridge.NEEDS_ACTIVATE)
 
 
-class ActiveTorBridgeManager(models.Manager):
+class ActiveTorBridgeManager(BridgeManager):
     def get_queryset(self):
         return super().get_queryset().filter(review_status=TorBridge.ACTIVE)
 
 
-class SuspendedTorBridgeManager(models.Manager):
+class SuspendedTorBridgeManager(BridgeManager):
     def get_queryset(self):
         return super().get_queryset().filter(review_status=TorBridge.NEEDS_SUSPEND)
 
 
-class DeletedTorBridgeManager(models.Manager):
+class DeletedTorBridgeManager(BridgeManager):
     def get_queryset(self):
         return super().get_queryset().filter(review_status=TorBridge.NEEDS_DELETE)
 
@@ -476,6 +721,18 @@ class Bridge(Product):
 
     previous_status = None
 
+    # messages that are pushed to the HostConsumer of the host when the status changes to
+    HOST_COMMANDS = {
+        NEEDS_ACTIVATE: 'bridge.activate',
+        NEEDS_SUSPEND: 'bridge.suspend',
+    }
+
+    # messages a host sends when it is done: message type -> (expected status, new status)
+    HOST_ACKNOWLEDGEMENTS = {
+        'bridge.activated': (NEEDS_ACTIVATE, ACTIVE),
+        'bridge.suspended': (NEEDS_SUSPEND, SUSPENDED),
+    }
+
     host = models.ForeignKey(Host, on_delete=models.CASCADE)
 
     port = models.PositiveIntegerField(verbose_name=_('Port'),
@@ -493,7 +750,7 @@ class Bridge(Product):
     is_monitored = models.BooleanField(default=True,
                                        verbose_name=_('Is bridge actively monitored?'))
 
-    objects = models.Manager()  # default
+    objects = BridgeManager()  # default
     initial = InitialTorBridgeManager()
     pending = PendingTorBridgeManager()
     active = ActiveTorBridgeManager()
@@ -502,6 +759,15 @@ class Bridge(Product):
 
     class Meta:
         abstract = True
+        indexes = [
+            # polled by the hosts (e.g. ?host=...&status=P)
+            models.Index(fields=['host', 'status'], name='%(class)s_host_status_idx'),
+            # periodic lifecycle sweeps (see shop.tasks)
+            models.Index(fields=['status', 'suspend_after'], name='%(class)s_status_suspend_idx'),
+            models.Index(fields=['status', 'modified_at'], name='%(class)s_status_mod_idx'),
+            # change feed of the hosts (see HostViewSet.tor_bridge_changes)
+            models.Index(fields=['host', 'modified_at'], name='%(class)s_host_mod_idx'),
+        ]
 
     def __str__(self):
         if self.port:
@@ -514,15 +780,37 @@ class Bridge(Product):
                                         self.get_status_display())
 
     def delete(self, using=None, keep_parents=False):
-        for pr in self.host.port_ranges.all():
+        with transaction.atomic():
             if isinstance(self.port, int):
-                try:
-                    if pr.check_port_usage(self.port):
-                        pr.remove_port_usage(self.port)
-                except PortNotInUseError:
-                    pass
+                pr = PortRange.objects.select_for_update().filter(host_id=self.host_id, start__lte=self.port,
+                                                                  end__gte=self.port).first()
+                if pr and pr.check_port_usage(self.port):
+                    pr.remove_port_usage(self.port)
+
+            super().delete(using, keep_parents)
+
+    def get_host_command(self):
+        """the message that tells the host what to do with this bridge (None if there is nothing to do)"""
+        if self.status not in self.HOST_COMMANDS:
+            return None
+        return {'type': self.HOST_COMMANDS[self.status],
+                'id': str(self.id),
+                'port': self.port,
+                'status': self.status}
 
-        super().delete(using, keep_parents)
+    @classmethod
+    def send_host_commands(cls, bridges):
+        """push the commands of the bridges to the channel group of their host (see HostConsumer)"""
+        channel_layer = get_channel_layer()
+        for bridge in bridges:
+            command = bridge.get_host_command()
+            if not command or not bridge.host.token_user:
+                continue
+            try:
+                async_to_sync(channel_layer.group_send)(bridge.host.token_user.username, command)
+            except CHANNEL_LAYER_ERRORS as err:
+                # hosts that are not connected pick this up from the change feed
+                log.warning(f"Unable to send {command['type']} to {bridge.host}: {err!r}")
 
     def process_activation(self):
         print("{} status was change to activated.".format(self._meta.verbose_name))
@@ -563,7 +851,7 @@ class Bridge(Product):
 class TorBridge(Bridge):
     PRODUCT = 'tor_bridge'
 
-    class Meta:
+    class Meta(Bridge.Meta):
         ordering = ['-created_at']
         verbose_name = _('Tor Bridge')
         verbose_name_plural = _('Tor Bridges')
@@ -575,6 +863,12 @@ class TorBridge(Bridge):
                               validators=[validate_target_is_onion,
                                           validate_target_has_port])
 
+    def get_host_command(self):
+        command = super().get_host_command()
+        if command:
+            command['target'] = self.target
+        return command
+
 
 class PurchaseOrderTorBridgeManager(models.Manager):
     """creates a purchase order for a new tor bridge"""
@@ -600,7 +894,7 @@ class PurchaseOrderTorBridgeManager(models.Manager):
 class RSshTunnel(Bridge):
     PRODUCT = 'rssh_tunnel'
 
-    class Meta:
+    class Meta(Bridge.Meta):
         ordering = ['-created_at']
         verbose_name = _('Reverse SSH Tunnel')
         verbose_name_plural = _('Reverse SSH Tunnels')
@@ -4,9 +4,10 @@ from functools import wraps
 
 from django.apps import apps
 from django.conf import settings
+from django.db import transaction
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save, post_init
+from django.db.models.signals import post_save, post_init, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -17,7 +18,7 @@ from charged.lnnode.signals import lnnode_invoice_created
 from charged.lnpurchase.models import PurchaseOrder
 from charged.lnpurchase.tasks import process_initial_purchase_order
 from charged.utils import add_change_log_entry
-from shop.models import TorBridge, RSshTunnel, Bridge
+from shop.models import TorBridge, RSshTunnel, Bridge, PortRange, Host
 
 log = logging.getLogger(__name__)
 
@@ -48,6 +49,15 @@ def lninvoice_invoice_created_on_node_handler(sender, instance, **kwargs):
     print("received by: lninvoice_invoice_created_on_node_handler")
     print(f"received Sender: {sender}")
     print(f"received Instance: {instance}")
+
+    lnnode = instance.lnnode
+    if (getattr(settings, 'CHARGED_LNNODE_SETTLEMENT_LISTENER', False) and lnnode.supports_streaming) or \
+            (getattr(settings, 'CHARGED_LNINVOICE_RECONCILIATION', False) and lnnode.supports_listing):
+        # the settlement listener or reconcile_invoices will pick up the payment - only check once after
+        # the invoice expired
+        check_lni_for_successful_payment.apply_async(priority=6, args=(instance.id,), countdown=instance.expiry + 5)
+        return
+
     check_lni_for_successful_payment.apply_async(priority=6, args=(instance.id,), countdown=3)
 
 
@@ -101,7 +111,8 @@ def post_save_purchase_order(sender, instance: PurchaseOrder, created, **kwargs)
 def post_save_lninvoice(sender, instance: PurchaseOrderInvoice, created, **kwargs):
     if created:
         print(f'New LNI with pk: {instance.pk} was created.')
-        process_initial_lni.apply_async(priority=0, args=(instance.pk,), countdown=1)
+        # not before the invoice is committed (it may be created in a transaction)
+        transaction.on_commit(lambda: process_initial_lni.apply_async(priority=0, args=(instance.pk,), countdown=1))
 
 
 @receiver(post_save, sender=TorBridge)
@@ -115,6 +126,9 @@ def post_save_tor_bridge(sender, instance: TorBridge, **kwargs):
         elif instance.status == sender.NEEDS_SUSPEND:
             instance.process_suspension()
 
+        if instance.status in sender.HOST_COMMANDS:
+            transaction.on_commit(lambda: sender.send_host_commands([instance]))
+
     if created:
         print("Tor Bridge created - setting random port...")
         instance.port = instance.host.get_random_port()
@@ -131,6 +145,22 @@ def post_save_tor_bridge(sender, instance: TorBridge, **kwargs):
         add_change_log_entry(instance, "created")
 
 
+@receiver(post_save, sender=PortRange)
+@disable_for_loaddata
+def post_save_port_range(sender, instance: PortRange, update_fields=None, **kwargs):
+    # port (de-)allocation updates the host counters itself (see PortRange.add_port_usage)
+    if update_fields and set(update_fields) <= {'usage', 'used_count', 'modified_at'}:
+        return
+    instance.host.update_ports_available()
+
+
+@receiver(post_delete, sender=PortRange)
+def post_delete_port_range(sender, instance: PortRange, **kwargs):
+    host = Host.objects.filter(pk=instance.host_id).first()
+    if host:  # may be gone already (cascade)
+        host.update_ports_available()
+
+
 @receiver(post_init, sender=TorBridge)
 def remember_status_tor_bridge(sender, instance: TorBridge, **kwargs):
     instance.previous_status = instance.status
@@ -151,3 +181,17 @@ def create_default_operator_group(sender, **kwargs):
             obj.permissions.add(p)
 
     # ToDo(frennkie) additional permissions (e.g. PO Invoices, POs)
+
+
+def convert_legacy_port_usage(sender, **kwargs):
+    """convert port usage stored in the legacy text format (PortRange._used) to bitmaps"""
+    legacy = PortRange.objects.exclude(_used__in=['', '{}', 'set()'])
+    for port_range in legacy:
+        if port_range.convert_legacy_usage():
+            log.info(f'Converted port usage of {port_range}.')
+
+
+def update_hosts_ports_available(sender, **kwargs):
+    """make sure the available port counters of all hosts are initialized"""
+    for host in Host.objects.all():
+        host.update_ports_available()
@@ -2,9 +2,12 @@ from datetime import timedelta
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.core.mail import get_connection
+from django.db import transaction
 from django.utils import timezone
 
-from charged.utils import handle_obj_is_alive_change, add_change_log_entry
+from charged.utils import add_change_log_entries, create_is_alive_change_email, MailNotificationToOwnerError
+from shop import heartbeat
 from shop.models import TorBridge, Host
 
 logger = get_task_logger(__name__)
@@ -34,83 +37,112 @@ def host_alive_check(self, obj_id=None):
     if obj_id:
         hosts = Host.objects.filter(pk=obj_id)
 
-        if not hosts[0]:
+        if not hosts.exists():
             logger.warning(f"Host not found: {obj_id}")
             raise HostNotFoundError
     else:
         hosts = Host.objects.filter(is_enabled=True)
 
-    for host in hosts:
-        alive = host.check_alive_status()
+    now = timezone.now()
+    alive = Host.get_alive_q(now)
 
-        if host.is_alive == alive:
-            logger.debug(f"Host {host} *is_alive* status did not change - is still: {alive}")
-            continue  # no change
-        else:
-            logger.debug(f"Host {host} *is_alive* status changed - is now: {alive}")
-            handle_obj_is_alive_change(host, alive)
+    with transaction.atomic():
+        # only the hosts whose status flips (computed by the database)
+        hosts = hosts.select_related('owner').select_for_update(of=('self',))
+        changes = {
+            True: list(hosts.filter(is_alive=False).filter(alive)),
+            False: list(hosts.filter(is_alive=True).exclude(alive)),
+        }
+
+        for status, changed in changes.items():
+            if not changed:
+                continue
+
+            logger.debug(f"{len(changed)} Host(s) *is_alive* status changed - is now: {status}")
+            Host.objects.filter(pk__in=[x.pk for x in changed]).update(is_alive=status, modified_at=now)
+            add_change_log_entries(changed, "Task: Check_alive -> set is_alive=%s" % status)
+
+        notifications = [(str(x.pk), status) for status, changed in changes.items() for x in changed
+                         if x.owner.email]
+        if notifications:
+            transaction.on_commit(lambda: send_host_is_alive_change_notifications.delay(notifications))
+
+
+@shared_task(ignore_result=True)
+def persist_host_heartbeats():
+    """write the last check-ins (heartbeats) from redis to the hosts (should run more often than
+    Host.CHECK_IN_TIMEOUT so that no heartbeat expires unpersisted)"""
+    hosts = {str(x.pk): x for x in Host.objects.filter(is_enabled=True).only('ci_date', 'ci_status', 'ci_message')}
+    try:
+        check_ins = heartbeat.get_check_ins(hosts)
+    except heartbeat.HeartbeatUnavailable as err:
+        logger.info(f"Heartbeats not available (check-ins are written to the database): {err}")
+        return
+
+    changed = []
+    for host_id, (ci_date, ci_status, ci_message) in check_ins.items():
+        host = hosts[host_id]
+        if host.ci_date is not None and host.ci_date >= ci_date:
+            continue
+        host.ci_date, host.ci_status, host.ci_message = ci_date, ci_status, ci_message
+        changed.append(host)
+
+    Host.objects.bulk_update(changed, ['ci_date', 'ci_status', 'ci_message'], batch_size=500)
+    logger.debug(f"Persisted heartbeats of {len(changed)} Host(s)")
+
+
+@shared_task(ignore_result=True)
+def send_host_is_alive_change_notifications(notifications):
+    """e-mail the owners about hosts whose is_alive status changed (all messages use one connection)"""
+    status = dict(notifications)
+    hosts = Host.objects.filter(pk__in=status).select_related('owner')
+
+    messages = [create_is_alive_change_email(host, status[str(host.pk)]) for host in hosts]
+    try:
+        get_connection().send_messages(messages)
+    except Exception:
+        raise MailNotificationToOwnerError
 
 
 @shared_task()
 def delete_due_tor_bridges():
-    counter = 0
     deleted = TorBridge.objects.filter(status=TorBridge.NEEDS_DELETE)
-    if deleted:
-        for item in deleted:
-            logger.debug('Running on: %s' % item)
-            item.delete()
-            counter += 1
 
-    return f'Removed {counter}/{len(deleted)} Tor Bridge(s) from DB (previous state: NEEDS_DELETE).'
+    # releases the ports of all bridges with one update per port range
+    _, counters = deleted.delete()
+    counter = counters.get(TorBridge._meta.label, 0)
+
+    return f'Removed {counter} Tor Bridge(s) from DB (previous state: NEEDS_DELETE).'
 
 
 @shared_task()
 def set_needs_delete_on_suspended_tor_bridges(days=45):
-    counter = 0
-    suspended = TorBridge.objects.filter(status=TorBridge.SUSPENDED)
-    if suspended:
-        for item in suspended:
-            logger.debug('Running on: %s' % item)
-            if timezone.now() > item.modified_at + timedelta(days=days):
-                logger.debug('Needs to be set to deleted.')
-                item.status = TorBridge.NEEDS_DELETE
-                item.save()
-                add_change_log_entry(item, "set to NEEDS_DELETE")
-                counter += 1
+    suspended = TorBridge.objects \
+        .filter(status=TorBridge.SUSPENDED) \
+        .filter(modified_at__lt=timezone.now() - timedelta(days=days))
+
+    counter = suspended.update_status(TorBridge.NEEDS_DELETE, "set to NEEDS_DELETE")
 
-    return f'Set NEEDS_DELETE on {counter}/{len(suspended)} Tor Bridge(s) (previous state: SUSPENDED).'
+    return f'Set NEEDS_DELETE on {counter} Tor Bridge(s) (previous state: SUSPENDED).'
 
 
 @shared_task()
 def set_needs_delete_on_initial_tor_bridges(days=3):
-    counter = 0
-    initials = TorBridge.objects.filter(status=TorBridge.INITIAL)
-    if initials:
-        for item in initials:
-            logger.debug('Running on: %s' % item)
-            if timezone.now() > item.modified_at + timedelta(days=days):
-                logger.debug('Needs to be set to deleted.')
-                item.status = TorBridge.NEEDS_DELETE
-                item.save()
-                add_change_log_entry(item, "set to NEEDS_DELETE")
-                counter += 1
+    initials = TorBridge.objects \
+        .filter(status=TorBridge.INITIAL) \
+        .filter(modified_at__lt=timezone.now() - timedelta(days=days))
 
-    return f'Set NEEDS_DELETE on {counter}/{len(initials)} Tor Bridge(s) (previous state: INITIAL).'
+    counter = initials.update_status(TorBridge.NEEDS_DELETE, "set to NEEDS_DELETE")
+
+    return f'Set NEEDS_DELETE on {counter} Tor Bridge(s) (previous state: INITIAL).'
 
 
 @shared_task()
 def set_needs_suspend_on_expired_tor_bridges():
-    counter = 0
-    actives = TorBridge.objects.filter(status=TorBridge.ACTIVE)
-    if actives:
-        for item in actives:
-            logger.info('Running on: %s' % item)
-
-            if timezone.now() > item.suspend_after:
-                logger.info('Needs to be suspended.')
-                item.status = TorBridge.NEEDS_SUSPEND
-                item.save()
-                add_change_log_entry(item, "set to NEEDS_SUSPEND")
-                counter += 1
-
-    return f'Set NEEDS_SUSPEND on {counter}/{len(actives)} Tor Bridge(s) (previous state: ACTIVE).'
+    expired = TorBridge.objects \
+        .filter(status=TorBridge.ACTIVE) \
+        .filter(suspend_after__lt=timezone.now())
+
+    counter = expired.update_status(TorBridge.NEEDS_SUSPEND, "set to NEEDS_SUSPEND")
+
+    return f'Set NEEDS_SUSPEND on {counter} Tor Bridge(s) (previous state: ACTIVE).'
@@ -1 +1,625 @@
-# Create your tests here.
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.forms import inlineformset_factory
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from charged.lnpurchase.models import PurchaseOrder, PurchaseOrderItemDetail
+from charged.utils import add_change_log_entry, buffered_change_log
+from shop.api.v1.views import HostViewSet
+from shop.consumers import HostConsumer
+from shop.forms import PortRangeInlineFormSet
+from shop.models import Host, PortRange, TorBridge
+from shop.ports import PortBitmap, PortRangeIndex
+from shop.signals import convert_legacy_port_usage
+from shop.tasks import host_alive_check, send_host_is_alive_change_notifications
+from shop.tasks import persist_host_heartbeats, set_needs_suspend_on_expired_tor_bridges
+
+
+def create_owner():
+    owner = get_user_model().objects.create(username='owner', is_staff=True)
+    # change log entries are written for user_id=1
+    get_user_model().objects.get_or_create(pk=1, defaults={'username': 'admin'})
+    return owner
+
+
+class PortBitmapTest(SimpleTestCase):
+    def test_add_discard_contains(self):
+        bitmap = PortBitmap(20000, 20099)
+        bitmap.add(20000)
+        bitmap.add(20099)
+        bitmap.add(20042)
+        bitmap.discard(20042)
+
+        self.assertIn(20000, bitmap)
+        self.assertIn(20099, bitmap)
+        self.assertNotIn(20042, bitmap)
+        self.assertNotIn(30000, bitmap)
+        self.assertEqual(len(bitmap), 2)
+        self.assertEqual(list(PortBitmap(20000, 20099, bytes(bitmap))), [20000, 20099])
+
+    def test_random_free_until_exhausted(self):
+        bitmap = PortBitmap(20000, 20020)
+        for _ in range(21):
+            port = bitmap.random_free()
+            self.assertNotIn(port, bitmap)
+            bitmap.add(port)
+
+        self.assertIsNone(bitmap.random_free())
+
+        bitmap.discard(20013)
+        self.assertEqual(bitmap.random_free(), 20013)
+
+    def test_random_free_is_uniform_over_the_free_ports(self):
+        bitmap = PortBitmap(20000, 20019)
+        for port in range(20000, 20020):
+            if port not in (20005, 20017, 20019):
+                bitmap.add(port)
+
+        # k-th free port for k = randrange(number of free ports) - not the first free port after a long used run
+        with mock.patch('shop.ports.randrange', side_effect=[0, 1, 2]) as randrange:
+            self.assertEqual([bitmap.random_free() for _ in range(3)], [20005, 20017, 20019])
+        randrange.assert_called_with(3)
+
+
+class PortRangeIndexTest(SimpleTestCase):
+    def test_find_and_overlapping(self):
+        index = PortRangeIndex([(30000, 30099, 'b'), (20000, 20099, 'a'), (40000, 40000, 'c')])
+
+        self.assertEqual(index.find(20000), 'a')
+        self.assertEqual(index.find(30099), 'b')
+        self.assertEqual(index.find(40000), 'c')
+        self.assertIsNone(index.find(19999))
+        self.assertIsNone(index.find(30100))
+
+        self.assertEqual(index.overlapping(20050, 29999), (20000, 20099, 'a'))
+        self.assertEqual(index.overlapping(10000, 50000)[2], 'c')
+        self.assertIsNone(index.overlapping(20100, 29999))
+        self.assertIsNone(index.overlapping(20000, 20099, exclude='a'))
+
+
+class HostGetRandomPortTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20009)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=30000, end=30004)
+
+    def test_returns_none_only_when_exhausted(self):
+        ports = [self.host.get_random_port() for _ in range(15)]
+
+        self.assertNotIn(None, ports)
+        self.assertEqual(len(set(ports)), 15)
+        self.assertIsNone(self.host.get_random_port())
+
+    def test_overlapping_port_range_is_rejected(self):
+        port_range = PortRange(host=self.host, type=PortRange.TOR_BRIDGE, start=20005, end=20020)
+        with self.assertRaises(ValidationError):
+            port_range.clean()
+
+        port_range.start = 20010
+        port_range.clean()
+
+    def test_port_ranges_of_one_formset_must_not_overlap(self):
+        formset_class = inlineformset_factory(Host, PortRange, formset=PortRangeInlineFormSet,
+                                              fields=('type', 'start', 'end'), extra=2)
+
+        def formset(*ranges):
+            data = {'port_ranges-TOTAL_FORMS': '2', 'port_ranges-INITIAL_FORMS': '0'}
+            for i, (start, end) in enumerate(ranges):
+                data.update({f'port_ranges-{i}-type': PortRange.TOR_BRIDGE,
+                             f'port_ranges-{i}-start': start, f'port_ranges-{i}-end': end})
+            return formset_class(data, instance=self.host, prefix='port_ranges')
+
+        self.assertFalse(formset((40000, 40100), (40050, 40200)).is_valid())
+        self.assertTrue(formset((40000, 40100), (40101, 40200)).is_valid())
+
+    def test_bridge_delete_releases_port_of_containing_range(self):
+        bridge = TorBridge.objects.create(host=self.host, target='example.onion:80')
+        other_ports = [self.host.get_random_port() for _ in range(3)]
+
+        bridge.delete()
+
+        used = set()
+        for port_range in self.host.port_ranges.all():
+            used |= port_range.used
+        self.assertEqual(used, set(other_ports))
+        self.assertEqual(Host.objects.get(pk=self.host.pk).tor_bridge_ports_available, 12)
+
+    def test_allocations_from_stale_instances_do_not_collide(self):
+        # two workers that loaded the host (and its port ranges) before either of them allocated a port
+        first, second = Host.objects.get(pk=self.host.pk), Host.objects.get(pk=self.host.pk)
+        list(first.port_ranges.all()), list(second.port_ranges.all())
+
+        ports = [host.get_random_port() for _ in range(8) for host in (first, second)][:15]
+
+        self.assertEqual(len(set(ports)), 15)
+        self.assertIsNone(first.get_random_port())
+        self.assertIsNone(second.get_random_port())
+        self.assertEqual(Host.objects.get(pk=self.host.pk).tor_bridge_ports_available, 0)
+
+    def test_port_ranges_are_locked_while_the_port_is_reserved(self):
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as select_for_update:
+            port = self.host.get_random_port()
+
+        select_for_update.assert_called_once()
+        self.assertEqual(select_for_update.call_args[0][0].model, PortRange)
+        self.assertIn(port, set.union(*(x.used for x in PortRange.objects.all())))
+
+
+class HostPortsAvailableTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        self.port_range = PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE,
+                                                   start=20000, end=20009)
+        PortRange.objects.create(host=self.host, type=PortRange.RSSH_TUNNEL, start=30000, end=30004)
+
+    def assertPortsAvailable(self, tor_bridge, rssh_tunnels):
+        host = Host.objects.get(pk=self.host.pk)
+        self.assertEqual(host.tor_bridge_ports_available, tor_bridge)
+        self.assertEqual(host.rssh_tunnels_ports_available, rssh_tunnels)
+
+    def test_counters_follow_port_ranges_and_usage(self):
+        self.assertPortsAvailable(10, 5)
+
+        self.port_range.add_port_usage(20001)
+        self.port_range.add_port_usage(20002)
+        self.assertPortsAvailable(8, 5)
+
+        self.host.save()  # must not overwrite the counters with stale values
+        self.assertPortsAvailable(8, 5)
+
+        self.port_range.remove_port_usage(20001)
+        self.port_range.end = 20019
+        self.port_range.save()
+        self.assertPortsAvailable(19, 5)
+
+        self.port_range.delete()
+        self.assertPortsAvailable(0, 5)
+
+
+class PortRangeLegacyUsageTest(TestCase):
+    def setUp(self):
+        self.host = Host.objects.create(ip='192.0.2.1', owner=create_owner())
+        self.port_range = PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE,
+                                                   start=20000, end=20009)
+        self.empty = PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=30000, end=30009)
+
+    def test_legacy_usage_is_converted_after_migrate(self):
+        self.port_range.add_port_usage(20003)
+        # out of range ports are dropped (and ports that are already in the bitmap are not counted twice)
+        PortRange.objects.filter(pk=self.port_range.pk).update(_used='{20001, 20003, 20009, 19999, 30000}')
+        PortRange.objects.filter(pk=self.empty.pk).update(_used='set()')
+
+        convert_legacy_port_usage(sender=None)
+        self.host.update_ports_available()
+
+        port_range = PortRange.objects.get(pk=self.port_range.pk)
+        self.assertEqual(port_range._used, '{}')
+        self.assertEqual(port_range.used, {20001, 20003, 20009})
+        self.assertEqual(port_range.used_count, 3)
+
+        empty = PortRange.objects.get(pk=self.empty.pk)
+        self.assertEqual(empty._used, 'set()')
+        self.assertEqual((empty.used, empty.used_count), (set(), 0))
+        self.assertEqual(Host.objects.get(pk=self.host.pk).tor_bridge_ports_available, 17)
+
+        convert_legacy_port_usage(sender=None)  # nothing left to convert
+        self.assertEqual(PortRange.objects.get(pk=self.port_range.pk).used_count, 3)
+
+
+class BridgeBulkDeleteTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20009)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=30000, end=30009)
+
+    def test_queryset_delete_releases_ports(self):
+        for _ in range(12):
+            TorBridge.objects.create(host=self.host, target='example.onion:80')
+        keep = TorBridge.objects.first()
+        TorBridge.objects.exclude(pk=keep.pk).update(status=TorBridge.NEEDS_DELETE)
+
+        _, counters = TorBridge.objects.filter(status=TorBridge.NEEDS_DELETE).delete()
+
+        self.assertEqual(counters[TorBridge._meta.label], 11)
+        self.assertEqual(Host.objects.get(pk=self.host.pk).tor_bridge_ports_available, 19)
+        used = set()
+        for port_range in self.host.port_ranges.all():
+            used |= port_range.used
+        self.assertEqual(used, {keep.port})
+
+    def test_admin_delete_is_logged_once(self):
+        bridges = [TorBridge.objects.create(host=self.host, target='example.onion:80') for _ in range(2)]
+        superuser = get_user_model().objects.create_superuser('root', 'root@example.com', 'secret')
+        self.client.force_login(superuser)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/shop/torbridge/', {'action': 'delete_selected', 'post': 'yes',
+                                                                   '_selected_action': [x.pk for x in bridges]})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(TorBridge.objects.exists())
+        self.assertEqual(sorted(LogEntry.objects.filter(action_flag=DELETION).values_list('object_id', 'user_id')),
+                         sorted((str(x.pk), superuser.pk) for x in bridges))
+
+
+class TorBridgeSweepTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20009)
+
+    def test_set_needs_suspend_on_expired_tor_bridges(self):
+        expired = TorBridge.objects.create(host=self.host, target='expired.onion:80')
+        valid = TorBridge.objects.create(host=self.host, target='valid.onion:80')
+        TorBridge.objects.update(status=TorBridge.ACTIVE)
+        TorBridge.objects.filter(pk=expired.pk).update(suspend_after=timezone.now() - timedelta(seconds=1))
+
+        with self.assertNumQueries(5):  # incl. savepoint + release
+            set_needs_suspend_on_expired_tor_bridges()
+
+        self.assertEqual(TorBridge.objects.get(pk=expired.pk).status, TorBridge.NEEDS_SUSPEND)
+        self.assertEqual(TorBridge.objects.get(pk=valid.pk).status, TorBridge.ACTIVE)
+
+
+class HostAliveCheckTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        owner.email = 'owner@example.com'
+        owner.save()
+
+        now = timezone.now()
+        self.came_up = Host.objects.create(ip='192.0.2.1', name='up', owner=owner)
+        self.went_down = Host.objects.create(ip='192.0.2.2', name='down', owner=owner)
+        self.still_up = Host.objects.create(ip='192.0.2.3', name='still', owner=owner)
+        Host.objects.filter(pk=self.came_up.pk).update(ci_date=now, is_alive=False)
+        Host.objects.filter(pk=self.went_down.pk).update(ci_date=now - timedelta(minutes=10), is_alive=True)
+        Host.objects.filter(pk=self.still_up.pk).update(ci_date=now, is_alive=True)
+
+    def test_flipped_hosts_are_updated_in_bulk(self):
+        with mock.patch('shop.tasks.send_host_is_alive_change_notifications') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(8):  # 2 selects, 2 updates, 2 inserts + savepoint + release
+                    host_alive_check()
+
+        self.assertEqual(dict(Host.objects.values_list('name', 'is_alive')),
+                         {'up': True, 'down': False, 'still': True})
+        notify.delay.assert_called_once_with([(str(self.came_up.pk), True), (str(self.went_down.pk), False)])
+
+    def test_notifications_use_one_connection(self):
+        with mock.patch('shop.tasks.get_connection') as get_connection:
+            send_host_is_alive_change_notifications([(str(self.came_up.pk), True),
+                                                     (str(self.went_down.pk), False)])
+
+        messages = get_connection.return_value.send_messages.call_args[0][0]
+        self.assertEqual(sorted(x.body.rsplit(' - ', 1)[1] for x in messages),
+                         ['is_alive now: False', 'is_alive now: True'])
+
+
+class HostCheckInTest(TestCase):
+    def setUp(self):
+        self.host = Host.objects.create(ip='192.0.2.1', owner=create_owner())
+
+    def test_check_in_only_writes_check_in_columns(self):
+        now = timezone.now().replace(microsecond=0)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.host.check_in(message='hi', date=now))
+
+        self.host.refresh_from_db()
+        self.assertEqual((self.host.ci_date, self.host.ci_status, self.host.ci_message), (now, Host.HELLO, 'hi'))
+
+    def test_identical_check_ins_are_coalesced(self):
+        now = timezone.now().replace(microsecond=0)
+        self.host.check_in(date=now)
+
+        self.assertFalse(self.host.check_in(date=now + timedelta(seconds=30)))
+        self.assertTrue(self.host.check_in(status=Host.GOODBYE, date=now + timedelta(seconds=31)))
+        self.assertTrue(self.host.check_in(status=Host.GOODBYE, date=now + timedelta(minutes=2)))
+
+        self.host.refresh_from_db()
+        self.assertEqual((self.host.ci_date, self.host.ci_status), (now + timedelta(minutes=2), Host.GOODBYE))
+
+
+@mock.patch('shop.heartbeat.record')
+class HostHeartbeatTest(TestCase):
+    def setUp(self):
+        self.host = Host.objects.create(ip='192.0.2.1', owner=create_owner())
+        self.now = timezone.now().replace(microsecond=0)
+
+    def test_only_transitions_are_written(self, record):
+        self.assertTrue(self.host.check_in(date=self.now))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.host.check_in(date=self.now + timedelta(minutes=2)))
+        self.assertTrue(self.host.check_in(status=Host.GOODBYE, date=self.now + timedelta(minutes=3)))
+
+        self.assertEqual(record.call_count, 3)
+        self.host.refresh_from_db()
+        self.assertEqual((self.host.ci_date, self.host.ci_status), (self.now + timedelta(minutes=3), Host.GOODBYE))
+
+    def test_alive_lookup_uses_heartbeats(self, record):
+        Host.objects.filter(pk=self.host.pk).update(is_alive=True)
+        with mock.patch('shop.heartbeat.get_alive_host_ids', return_value={str(self.host.pk)}):
+            self.assertEqual(list(Host.active.checked_in()), [self.host])
+        with mock.patch('shop.heartbeat.get_alive_host_ids', return_value=set()):
+            self.assertEqual(list(Host.active.checked_in()), [])
+
+    def test_persist_host_heartbeats(self, record):
+        self.host.check_in(date=self.now)
+        check_ins = {str(self.host.pk): (self.now + timedelta(minutes=2), Host.HELLO, '')}
+        with mock.patch('shop.heartbeat.get_check_ins', return_value=check_ins):
+            persist_host_heartbeats()
+
+        self.host.refresh_from_db()
+        self.assertEqual(self.host.ci_date, self.now + timedelta(minutes=2))
+
+
+class BufferedChangeLogTest(TestCase):
+    def setUp(self):
+        self.host = Host.objects.create(ip='192.0.2.1', owner=create_owner())
+
+    def test_entries_are_written_with_one_insert(self):
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            with buffered_change_log():
+                with buffered_change_log():
+                    add_change_log_entry(self.host, 'one')
+                add_change_log_entry(self.host, 'two')
+
+        self.assertEqual(list(LogEntry.objects.order_by('pk').values_list('change_message', flat=True)),
+                         ['one', 'two'])
+
+    def test_entries_are_written_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                with buffered_change_log():
+                    add_change_log_entry(self.host, 'committed')
+                self.assertFalse(LogEntry.objects.exists())
+
+        self.assertEqual(LogEntry.objects.get().object_id, str(self.host.pk))
+
+    def test_entries_are_discarded_on_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    with buffered_change_log():
+                        add_change_log_entry(self.host, 'rolled back')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertFalse(LogEntry.objects.exists())
+
+    def test_entries_of_rolled_back_inner_block_are_discarded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with buffered_change_log():
+                add_change_log_entry(self.host, 'kept')
+                try:
+                    with transaction.atomic():
+                        add_change_log_entry(self.host, 'rolled back')
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+
+        self.assertEqual(list(LogEntry.objects.values_list('change_message', flat=True)), ['kept'])
+
+    def test_committed_entries_are_written_if_the_block_raises(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with buffered_change_log():
+                    Host.objects.filter(pk=self.host.pk).update(name='changed')
+                    add_change_log_entry(self.host, 'committed')
+                    try:
+                        with transaction.atomic():
+                            add_change_log_entry(self.host, 'rolled back')
+                            raise RuntimeError
+                    except RuntimeError:
+                        pass
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(list(LogEntry.objects.values_list('change_message', flat=True)), ['committed'])
+
+
+class HostTorBridgeChangesTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20199)
+        self.url = f'/api/v1/hosts/{self.host.pk}/tor_bridge_changes/'
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.host.token_user)
+
+    @mock.patch.object(HostViewSet, 'CHANGES_SETTLE_TIME', timedelta(0))
+    def test_returns_changes_after_cursor(self):
+        first = TorBridge.objects.create(host=self.host, target='first.onion:80')
+        second = TorBridge.objects.create(host=self.host, target='second.onion:80')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([x['id'] for x in response.data['results']], [str(first.pk), str(second.pk)])
+
+        cursor = response.data['cursor']
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(response.data, {'cursor': cursor, 'results': []})
+
+        TorBridge.objects.filter(pk=second.pk).update_status(TorBridge.NEEDS_ACTIVATE, "set to pending")
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual([(x['id'], x['status']) for x in response.data['results']],
+                         [(str(second.pk), TorBridge.NEEDS_ACTIVATE)])
+        self.assertNotEqual(response.data['cursor'], cursor)
+
+    def test_changes_with_the_same_modification_date_are_not_skipped(self):
+        TorBridge.objects.bulk_create([TorBridge(host=self.host, port=20000 + i, target='example.onion:80')
+                                       for i in range(150)])
+        TorBridge.objects.update(modified_at=timezone.now() - timedelta(minutes=1))
+
+        seen, cursor = [], ''
+        for _ in range(3):
+            response = self.client.get(self.url, {'cursor': cursor})
+            seen.extend(x['id'] for x in response.data['results'])
+            cursor = response.data['cursor']
+
+        self.assertEqual(len(seen), 150)
+        self.assertEqual(set(seen), {str(x) for x in TorBridge.objects.values_list('pk', flat=True)})
+
+    def test_late_commits_are_not_skipped(self):
+        bridge = TorBridge.objects.create(host=self.host, target='example.onion:80')
+        response = self.client.get(self.url)
+        cursor = response.data['cursor']
+
+        # the cursor stays behind recent changes - e.g. of a transaction that is not committed yet
+        self.assertEqual([x['id'] for x in self.client.get(self.url, {'cursor': cursor}).data['results']],
+                         [str(bridge.pk)])
+
+    def test_other_hosts_are_not_found(self):
+        other = Host.objects.create(ip='192.0.2.2', name='other', owner=self.host.owner)
+        response = self.client.get(f'/api/v1/hosts/{other.pk}/tor_bridge_changes/')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(self.url, {'cursor': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class HostConsumerTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20009)
+        self.bridge = TorBridge.objects.create(host=self.host, target='example.onion:80')
+
+        self.consumer = HostConsumer()
+        self.consumer.scope = {'user': self.host.token_user}
+        self.consumer.user = self.host.token_user
+        self.sent = []
+        self.consumer.send_json = self.sent.append
+
+    def test_status_change_is_pushed_to_host_group(self):
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(self.host.token_user.username, channel_name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TorBridge.objects.filter(pk=self.bridge.pk).update_status(TorBridge.NEEDS_ACTIVATE, "set to pending")
+
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message, {'type': 'bridge.activate',
+                                   'id': str(self.bridge.pk),
+                                   'port': self.bridge.port,
+                                   'status': TorBridge.NEEDS_ACTIVATE,
+                                   'target': 'example.onion:80'})
+
+    def test_channel_layer_errors_are_logged(self):
+        self.bridge.status = TorBridge.NEEDS_ACTIVATE
+        with mock.patch('shop.models.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock(side_effect=ConnectionRefusedError('redis down'))
+            with self.assertLogs('shop.models', 'WARNING') as logs:
+                TorBridge.send_host_commands([self.bridge])
+            self.assertIn('redis down', logs.output[0])
+
+            get_layer.return_value.group_send.side_effect = ValueError('bug')
+            with self.assertRaises(ValueError):
+                TorBridge.send_host_commands([self.bridge])
+
+    def test_acknowledge_activation(self):
+        TorBridge.objects.filter(pk=self.bridge.pk).update(status=TorBridge.NEEDS_ACTIVATE)
+
+        self.consumer.receive_json({'type': 'bridge.activated', 'id': str(self.bridge.pk)})
+        self.consumer.receive_json({'type': 'bridge.suspended', 'id': str(self.bridge.pk)})  # not expected
+        self.consumer.receive_json({'type': 'bridge.activated', 'id': 'invalid'})
+
+        self.assertEqual(TorBridge.objects.get(pk=self.bridge.pk).status, TorBridge.ACTIVE)
+        self.assertEqual([(x['type'], x.get('status')) for x in self.sent],
+                         [('bridge.activated.ack', TorBridge.ACTIVE),
+                          ('bridge.suspended.ack', TorBridge.ACTIVE),
+                          ('error', None)])
+
+
+class PublicPurchaseOrderViewSetTest(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        with mock.patch('shop.signals.process_initial_purchase_order'):
+            self.po = PurchaseOrder.objects.create()
+        for i in range(3):
+            host = Host.objects.create(ip=f'192.0.2.{i}', name=f'host{i}', owner=owner)
+            bridge = TorBridge.objects.create(host=host, port=20000 + i, target='example.onion:80')
+            PurchaseOrderItemDetail.objects.create(po=self.po, product=bridge, price=1000, quantity=1)
+        self.client = APIClient()
+
+    def test_purchase_order_queries_do_not_depend_on_items(self):
+        with self.assertNumQueries(6):  # po, items, tor bridges, hosts, sites, invoices
+            response = self.client.get(f'/api/v1/public/pos/{self.po.pk}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(x['product']['host']['name'] for x in response.data['item_details']),
+                         ['host0', 'host1', 'host2'])
+
+    def test_item_detail(self):
+        item = self.po.item_details.first()
+        with self.assertNumQueries(4):  # item, tor bridge, host, site
+            response = self.client.get(f'/api/v1/public/po_items/{item.pk}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['product']['id'], item.object_id)
+
+
+class HostGetRandomPortConcurrencyTest(TransactionTestCase):
+    threads = 8
+    ports_per_thread = 25
+
+    def setUp(self):
+        owner = create_owner()
+        self.host = Host.objects.create(ip='192.0.2.1', owner=owner)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=20000, end=20099)
+        PortRange.objects.create(host=self.host, type=PortRange.TOR_BRIDGE, start=30000, end=30099)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_parallel_allocation_has_no_duplicates_or_lost_ports(self):
+        allocated = []
+        errors = []
+        lock = threading.Lock()
+
+        def allocate():
+            try:
+                host = Host.objects.get(pk=self.host.pk)
+                for _ in range(self.ports_per_thread):
+                    port = host.get_random_port()
+                    with lock:
+                        allocated.append(port)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=allocate) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertNotIn(None, allocated)
+        self.assertEqual(len(allocated), self.threads * self.ports_per_thread)
+        self.assertEqual(len(set(allocated)), len(allocated))
+
+        used = set()
+        for port_range in self.host.port_ranges.all():
+            self.assertEqual(port_range.used_count, len(port_range.bitmap))
+            used |= port_range.used
+        self.assertEqual(used, set(allocated))
+
+        self.assertIsNone(self.host.get_random_port())
@@ -10,7 +10,7 @@ class HostListView(generic.ListView):
     model = Host
 
     def get_queryset(self):
-        return Host.active.all()
+        return Host.active.select_related('owner')
 
 
 class PurchaseTorBridgeOnHostView(generic.UpdateView):